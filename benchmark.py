@@ -0,0 +1,229 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+import m3
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+phases = ["load", "resolve", "validate", "serialize", "save"]
+
+def createInstance(structureName, structureVersion=None):
+    structureHistory = m3.structures[structureName]
+    if structureVersion == None:
+        return structureHistory.getNewestVersion().createInstance()
+    return structureHistory.getVersion(structureVersion).createInstance()
+
+def createSyntheticModel(numberOfVertices, numberOfBones, numberOfSequences, numberOfKeys, seed=1):
+    """ Creates a model with a single mesh region and one animated transformation per bone and sequence """
+    randomGenerator = random.Random(seed)
+    model = createInstance("MODL", 23)
+    model.modelName = "Benchmark"
+    model.vFlags = 0x182007d
+    vertexStructureDescription = m3.vertexStructureDescriptionOf(model)
+    vertices = []
+    for i in range(numberOfVertices):
+        vertex = vertexStructureDescription.createInstance()
+        vertex.position.x = randomGenerator.random()
+        vertex.position.y = randomGenerator.random()
+        vertex.position.z = randomGenerator.random()
+        vertex.boneWeight0 = 255
+        vertex.normal.z = 1.0
+        vertex.uv0.x = randomGenerator.randrange(0, 2048)
+        vertex.uv0.y = randomGenerator.randrange(0, 2048)
+        vertices.append(vertex)
+    model.vertices = vertexStructureDescription.instancesToBytes(vertices)
+
+    division = createInstance("DIV_")
+    division.faces = [randomGenerator.randrange(0, numberOfVertices) for i in range(numberOfVertices * 3)]
+    region = createInstance("REGN", 3)
+    region.numberOfVertices = numberOfVertices
+    region.numberOfFaceVertexIndices = len(division.faces)
+    division.regions = [region]
+    division.objects = [createInstance("BAT_")]
+    division.msec = [createInstance("MSEC")]
+    model.divisions = [division]
+
+    model.boneLookup = list(range(numberOfBones))
+    for boneIndex in range(numberOfBones):
+        bone = createInstance("BONE")
+        bone.name = "Bone%d" % boneIndex
+        bone.parent = boneIndex - 1
+        bone.location.header.animId = 0x1000 + boneIndex
+        bone.rotation.header.animId = 0x2000 + boneIndex
+        bone.scale.header.animId = 0x3000 + boneIndex
+        model.bones.append(bone)
+
+    for sequenceIndex in range(numberOfSequences):
+        sequence = createInstance("SEQS", 1)
+        sequence.name = "Sequence%d" % sequenceIndex
+        sequence.animEndInMS = numberOfKeys * 33
+        model.sequences.append(sequence)
+        stc = createInstance("STC_")
+        stc.name = "Sequence%d_full" % sequenceIndex
+        stc.stsIndex = sequenceIndex
+        stc.stsIndexCopy = sequenceIndex
+        for boneIndex in range(numberOfBones):
+            animationData = createInstance("SD3V")
+            animationData.frames = [keyIndex * 33 for keyIndex in range(numberOfKeys)]
+            animationData.fend = numberOfKeys * 33
+            for keyIndex in range(numberOfKeys):
+                key = createInstance("VEC3")
+                key.x = randomGenerator.random()
+                key.y = randomGenerator.random()
+                key.z = randomGenerator.random()
+                animationData.keys.append(key)
+            stc.sd3v.append(animationData)
+            stc.animIds.append(0x1000 + boneIndex)
+            stc.animRefs.append((2 << 16) + boneIndex)
+        model.sequenceTransformationCollections.append(stc)
+        stg = createInstance("STG_")
+        stg.name = "Sequence%d" % sequenceIndex
+        stg.stcIndices = [sequenceIndex]
+        model.sequenceTransformationGroups.append(stg)
+        sts = createInstance("STS_")
+        sts.animIds = [0x1000 + boneIndex for boneIndex in range(numberOfBones)]
+        sts.s1 = -1
+        model.sts.append(sts)
+    return model
+
+class PhaseMeasurement:
+    """ Measures the wall time and, if tracemalloc is running, the peak memory of the phases of a run """
+
+    def __init__(self):
+        self.times = {}
+        self.peakMemory = {}
+        self.currentPhase = None
+
+    def start(self, phase):
+        self.currentPhase = phase
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            self.memoryAtStart = tracemalloc.get_traced_memory()[0]
+        self.startTime = time.perf_counter()
+
+    def stop(self):
+        self.times[self.currentPhase] = time.perf_counter() - self.startTime
+        if tracemalloc.is_tracing():
+            self.peakMemory[self.currentPhase] = tracemalloc.get_traced_memory()[1] - self.memoryAtStart
+
+def runPhases(inputPath, outputPath, numpyArrays, lazy):
+    """ Loads, resolves, validates, serializes and saves the model once """
+    measurement = PhaseMeasurement()
+    measurement.start("load")
+    sections = m3.loadSections(inputPath, numpyArrays=numpyArrays, lazy=lazy)
+    measurement.stop()
+
+    measurement.start("resolve")
+    if lazy:
+        model = sections[0].content[0].model[0]
+    else:
+        m3.resolveReferencesOfSections(sections)
+        m3.checkThatAllSectionsGotReferenced(sections)
+        model = sections[0].content[0].model[0]
+    measurement.stop()
+    del sections
+
+    measurement.start("validate")
+    model.structureDescription.validateInstance(model, "model")
+    measurement.stop()
+
+    measurement.start("serialize")
+    fileBytes = m3.sectionsToBytes(m3.modelToSections(model))
+    measurement.stop()
+    del model
+
+    measurement.start("save")
+    with open(outputPath, "wb") as outputFile:
+        outputFile.write(fileBytes)
+    measurement.stop()
+    return measurement
+
+def runBenchmark(inputPath, repetitions, numpyArrays=False, lazy=False):
+    """ Returns the best time of each phase and the peak memory of each phase within a separate traced run """
+    with tempfile.TemporaryDirectory() as outputDirectory:
+        outputPath = os.path.join(outputDirectory, "benchmark.m3")
+        bestTimes = {}
+        for i in range(repetitions):
+            measurement = runPhases(inputPath, outputPath, numpyArrays, lazy)
+            for phase, phaseTime in measurement.times.items():
+                bestTimes[phase] = min(phaseTime, bestTimes.get(phase, phaseTime))
+        with open(inputPath, "rb") as inputFile, open(outputPath, "rb") as outputFile:
+            identical = inputFile.read() == outputFile.read()
+
+        tracemalloc.start()
+        try:
+            peakMemory = runPhases(inputPath, outputPath, numpyArrays, lazy).peakMemory
+        finally:
+            tracemalloc.stop()
+    return {"times": bestTimes, "peakMemory": peakMemory, "roundTripIdentical": identical}
+
+def printResults(results):
+    print("%-10s %10s %14s" % ("phase", "time [s]", "peak [MiB]"))
+    for phase in phases:
+        print("%-10s %10.3f %14.1f" % (phase, results["times"][phase], results["peakMemory"][phase] / (1024 * 1024)))
+    print("%-10s %10.3f" % ("total", sum(results["times"].values())))
+    if not results["roundTripIdentical"]:
+        print("WARNING: The saved file differs from the loaded one")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measures the load and save phases of the m3 library with a synthetic or a given model.")
+    parser.add_argument('m3File', nargs='?', help="Benchmark this m3 file instead of a synthetic model")
+    parser.add_argument('--vertices', type=int, default=20000, help="Number of vertices of the synthetic model")
+    parser.add_argument('--bones', type=int, default=40, help="Number of bones of the synthetic model")
+    parser.add_argument('--sequences', type=int, default=10, help="Number of animation sequences of the synthetic model")
+    parser.add_argument('--keys', type=int, default=200, help="Number of keyframes per animated bone property and sequence")
+    parser.add_argument('--seed', type=int, default=1, help="Seed for the random values of the synthetic model")
+    parser.add_argument('--repetitions', '-n', type=int, default=3, help="The best time of this many runs gets reported")
+    parser.add_argument('--numpy-arrays', action='store_true', default=False, help="Load primitive lists as numpy arrays")
+    parser.add_argument('--lazy', action='store_true', default=False, help="Load the sections lazily")
+    parser.add_argument('--json', help="Also write the results into this JSON file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workDirectory:
+        if args.m3File != None:
+            inputPath = args.m3File
+            description = {"file": inputPath}
+        else:
+            inputPath = os.path.join(workDirectory, "synthetic.m3")
+            description = {"vertices": args.vertices, "bones": args.bones, "sequences": args.sequences, "keys": args.keys, "seed": args.seed}
+            t0 = time.time()
+            model = createSyntheticModel(args.vertices, args.bones, args.sequences, args.keys, args.seed)
+            m3.saveAndInvalidateModel(model, inputPath)
+            del model
+            print("Created synthetic model with %s in %.2f s" % (", ".join("%s=%s" % item for item in description.items()), time.time() - t0))
+        description["fileSize"] = os.path.getsize(inputPath)
+        description["numpyArrays"] = args.numpy_arrays
+        description["lazy"] = args.lazy
+        results = runBenchmark(inputPath, args.repetitions, args.numpy_arrays, args.lazy)
+
+    printResults(results)
+    if args.json != None:
+        results["model"] = description
+        with open(args.json, "w") as jsonFile:
+            json.dump(results, jsonFile, indent=2)
+    if not results["roundTripIdentical"]:
+        sys.exit(1)
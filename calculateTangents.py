@@ -8,158 +8,255 @@ else:
     from . import m3
 
 import sys
+import os
 import argparse
-import math
-
-def normalize(x, y, z):
-    length = math.sqrt(x*x + y*y + z*z)
-    if length == 0:
-        return 0.0, 0.0, 0.0
-    return (x / length, y / length, z / length)
-
-def uvIntToFloat(m3UVCoordinate):
-    return (m3UVCoordinate.x / 2048.0, 1 - m3UVCoordinate.y / 2048.0)
-
-
-def recalculateTangentsOfFaces(m3VerticesToUpdate, faces):
-    faceIndexToTangentAndBitangentTupleList = {}
-    for face in faces:
-        vertex0 = m3VerticesToUpdate[face[0]]
-        vertex1 = m3VerticesToUpdate[face[1]]
-        vertex2 = m3VerticesToUpdate[face[2]]
-        
-        uv0 = uvIntToFloat(vertex0.uv0)
-        uv1 = uvIntToFloat(vertex1.uv0)
-        uv2 = uvIntToFloat(vertex2.uv0)
-        
-        u0 = uv0[0]
-        u1 = uv1[0]
-        u2 = uv2[0]
-        v0 = uv0[1]
-        v1 = uv1[1]
-        v2 = uv2[1]
-        
-        deltaU1 = u1 - u0
-        deltaU2 = u2 - u0
-        deltaV1 = v1 - v0
-        deltaV2 = v2 - v0
-        
-        e1x = vertex1.position.x - vertex0.position.x
-        e1y = vertex1.position.y - vertex0.position.y
-        e1z = vertex1.position.z - vertex0.position.z
-        
-        e2x = vertex2.position.x - vertex0.position.x
-        e2y = vertex2.position.y - vertex0.position.y
-        e2z = vertex2.position.z - vertex0.position.z
-        
-        inverseFactor = (deltaU1*deltaV2 - deltaU2*deltaV1)
-        if (inverseFactor < 0.00000001 and inverseFactor > -0.00000001):
-            continue;
-        factor = 1.0 / inverseFactor
-        tx = (deltaV2 * e1x - deltaV1 * e2x)
-        ty = (deltaV2 * e1y - deltaV1 * e2y)
-        tz = (deltaV2 * e1z - deltaV1 * e2z)
-        tx, ty, tz = normalize(tx, ty, tz)
-
-        bx = (- deltaU2 * e1x + deltaU1 * e2x)
-        by = (- deltaU2 * e1y + deltaU1 * e2y)
-        bz = (- deltaU2 * e1z + deltaU1 * e2z)
-        bx, by, bz = normalize(bx, by, bz)
-        
-        tangentBitangentTuple = ((tx, ty, tz), (bx, by, bz))
-        
-        listV0 = faceIndexToTangentAndBitangentTupleList.get(face[0],[])
-        listV0.append(tangentBitangentTuple)
-        faceIndexToTangentAndBitangentTupleList[face[0]] = listV0
-        
-        listV1 = faceIndexToTangentAndBitangentTupleList.get(face[1],[])
-        listV1.append(tangentBitangentTuple)
-        faceIndexToTangentAndBitangentTupleList[face[1]] = listV1
-        
-        listV2 = faceIndexToTangentAndBitangentTupleList.get(face[2],[])
-        listV2.append(tangentBitangentTuple)
-        faceIndexToTangentAndBitangentTupleList[face[2]] = listV2
-
-    for vertexIndex, tangentBitangentTupleList in faceIndexToTangentAndBitangentTupleList.items():
-        txsum = 0.0
-        tysum = 0.0
-        tzsum = 0.0
-        bxsum = 0.0
-        bysum = 0.0
-        bzsum = 0.0
-        count = 0
-        for tangent, bitangent in tangentBitangentTupleList:
-            txsum += tangent[0]
-            tysum += tangent[1]
-            tzsum += tangent[2]
-            bxsum += bitangent[0]
-            bysum += bitangent[1]
-            bzsum += bitangent[2]
-            count += 1
-        tx, ty, tz = normalize(txsum, tysum, tzsum)
-
-        bx = bxsum / count
-        by = bysum / count
-        bz = bzsum / count
-        bx, by, bz = normalize(bxsum, bysum, bzsum)
-
-        vertex = m3VerticesToUpdate[vertexIndex]
-        nx = vertex.normal.x
-        ny = vertex.normal.y
-        nz = vertex.normal.z
-        # determinant of:
-        # tx ty tz
-        # bx by bz
-        # nx ny nz
-        det = tx*by*nz + ty*bz*nx + tz*bx*ny - nx*by*tz - ny*bz*tx - nz*bx*ty
-        if det >= 0:# comparing in that correction seems to be correct...
-            sign = -1.0
-        else:
-            sign = 1.0
-
-        vertex.tangent.x = tx
-        vertex.tangent.y = ty
-        vertex.tangent.z = tz
-        vertex.sign = sign
-
-def recalculateTangentsOfDivisions(m3VerticesToUpdate, divisions):
-    faces = []
+import traceback
+import concurrent.futures
+
+# numpy gets imported via m3.importNumpy when tangents get calculated
+numpy = None
+
+def normalizeRows(vectors):
+    """ Normalizes the rows of the array in place and leaves rows of length 0 as they are """
+    lengths = numpy.sqrt(numpy.einsum("ij,ij->i", vectors, vectors))
+    nonZero = lengths != 0
+    vectors[nonZero] /= lengths[nonZero, numpy.newaxis]
+    return vectors
+
+def calculateTangents(positions, uvs, normals, faces):
+    """ Calculates the tangents and the handedness signs of the vertices.
+
+    positions and normals are arrays of shape (n, 3), uvs is an array of shape (n, 2)
+    with the uv coordinates as floats and faces is an array of shape (m, 3) with
+    vertex indices. Faces with degenerated uv coordinates get ignored.
+
+    Returns the tangents as array of shape (n, 3), the signs as array of shape (n,)
+    and a boolean array that tells which vertices were part of a considered face.
+    """
+    global numpy
+    numpy = m3.importNumpy("to calculate tangents")
+    positions = numpy.asarray(positions, dtype=numpy.float64)
+    uvs = numpy.asarray(uvs, dtype=numpy.float64)
+    normals = numpy.asarray(normals, dtype=numpy.float64)
+    faces = numpy.asarray(faces, dtype=numpy.intp).reshape(-1, 3)
+    numberOfVertices = len(positions)
+
+    uv0 = uvs[faces[:, 0]]
+    deltaUV1 = uvs[faces[:, 1]] - uv0
+    deltaUV2 = uvs[faces[:, 2]] - uv0
+    position0 = positions[faces[:, 0]]
+    edge1 = positions[faces[:, 1]] - position0
+    edge2 = positions[faces[:, 2]] - position0
+
+    inverseFactor = deltaUV1[:, 0] * deltaUV2[:, 1] - deltaUV2[:, 0] * deltaUV1[:, 1]
+    valid = numpy.abs(inverseFactor) >= 0.00000001
+    faces = faces[valid]
+    deltaU1 = deltaUV1[valid, 0, numpy.newaxis]
+    deltaV1 = deltaUV1[valid, 1, numpy.newaxis]
+    deltaU2 = deltaUV2[valid, 0, numpy.newaxis]
+    deltaV2 = deltaUV2[valid, 1, numpy.newaxis]
+    edge1 = edge1[valid]
+    edge2 = edge2[valid]
+
+    faceTangents = normalizeRows(deltaV2 * edge1 - deltaV1 * edge2)
+    faceBitangents = normalizeRows(deltaU1 * edge2 - deltaU2 * edge1)
+
+    # Each face contributes its tangent and bitangent to all 3 of its vertices
+    vertexIndices = faces.ravel()
+    tangents = numpy.zeros((numberOfVertices, 3))
+    bitangents = numpy.zeros((numberOfVertices, 3))
+    numpy.add.at(tangents, vertexIndices, numpy.repeat(faceTangents, 3, axis=0))
+    numpy.add.at(bitangents, vertexIndices, numpy.repeat(faceBitangents, 3, axis=0))
+    normalizeRows(tangents)
+    normalizeRows(bitangents)
+    usedVertices = numpy.bincount(vertexIndices, minlength=numberOfVertices) > 0
+
+    # determinant of the matrix with the rows tangent, bitangent and normal
+    determinants = numpy.einsum("ij,ij->i", numpy.cross(tangents, bitangents), normals)
+    # comparing in that correction seems to be correct...
+    signs = numpy.where(determinants >= 0, -1.0, 1.0)
+    return tangents, signs, usedVertices
+
+def vectorsOf(structuredArray, names):
+    return numpy.stack([structuredArray[name] for name in names], axis=-1)
+
+def facesOfDivisions(divisions):
+    """ Returns the faces of the objects of the divisions as array of shape (m, 3) with indices into the vertex list """
+    global numpy
+    numpy = m3.importNumpy("to determine the faces of divisions")
+    faceArrays = []
     for division in divisions:
-        divisionFaceIndices = division.faces
+        regionFaceArrays = m3.regionFaceArrays(division)
         for m3Object in division.objects:
-            region = division.regions[m3Object.regionIndex]
-            firstVertexIndexIndex = region.firstFaceVertexIndexIndex
-            lastVertexIndexIndex = firstVertexIndexIndex + region.numberOfFaceVertexIndices
-            vertexIndexIndex = firstVertexIndexIndex
-            firstVertexIndex = region.firstVertexIndex
-            assert region.numberOfFaceVertexIndices % 3 == 0
-
-            while vertexIndexIndex + 2 <= lastVertexIndexIndex:
-                i0 = firstVertexIndex + divisionFaceIndices[vertexIndexIndex]
-                i1 = firstVertexIndex + divisionFaceIndices[vertexIndexIndex + 1]
-                i2 = firstVertexIndex + divisionFaceIndices[vertexIndexIndex + 2]
-                face = (i0, i1, i2)
-                faces.append(face)
-                vertexIndexIndex += 3
-    recalculateTangentsOfFaces(m3VerticesToUpdate, faces)
+            faceArrays.append(regionFaceArrays[m3Object.regionIndex])
+    if len(faceArrays) == 0:
+        return numpy.zeros((0, 3), dtype=numpy.int32)
+    return numpy.concatenate(faceArrays)
+
+def recalculateTangentsOfVertexArray(vertices, faces):
+    """ Updates the tangent and sign fields of the vertex record array, see m3.vertexArray """
+    global numpy
+    numpy = m3.importNumpy("to calculate tangents")
+    xyz = ("x", "y", "z")
+    positions = vectorsOf(vertices.position, xyz)
+    normals = m3.fixed8ToFloat(vectorsOf(vertices.normal, xyz))
+    uvs = numpy.empty((len(vertices), 2))
+    uvs[:, 0] = vertices.uv0.x / 2048.0
+    uvs[:, 1] = 1 - vertices.uv0.y / 2048.0
+
+    tangents, signs, usedVertices = calculateTangents(positions, uvs, normals, faces)
+    tangentValues = m3.floatToFixed8(tangents[usedVertices])
+    for i, name in enumerate(xyz):
+        vertices.tangent[name][usedVertices] = tangentValues[:, i]
+    vertices.sign[usedVertices] = m3.floatToFixed8(signs[usedVertices])
 
 def recalculateTangentsOfModel(model):
-    vertexClassName = "VertexFormat" + hex(model.vFlags)
-    vertexStructureDescription = m3.structures[vertexClassName].getVersion(0)
-    numberOfVertices = round(len(model.vertices) / vertexStructureDescription.size)
-    m3VerticesToUpdate = vertexStructureDescription.createInstances(buffer=model.vertices, count=numberOfVertices)
+    """ Recalculates the tangents of the vertices used by the divisions of the model in place """
+    recalculateTangentsOfVertexArray(m3.vertexArray(model), facesOfDivisions(model.divisions))
 
-    recalculateTangentsOfDivisions(m3VerticesToUpdate, model.divisions)
+def tangentChangeOf(oldVertices, newVertices):
+    """ Returns the largest change of a tangent component or sign between two vertex arrays """
+    change = 0.0
+    oldValueArrays = [oldVertices.tangent.x, oldVertices.tangent.y, oldVertices.tangent.z, oldVertices.sign]
+    newValueArrays = [newVertices.tangent.x, newVertices.tangent.y, newVertices.tangent.z, newVertices.sign]
+    for oldValues, newValues in zip(oldValueArrays, newValueArrays):
+        if len(oldValues) > 0:
+            change = max(change, float(numpy.abs(m3.fixed8ToFloat(newValues) - m3.fixed8ToFloat(oldValues)).max()))
+    return change
 
 def convert(inputPath, outputPath):
     model = m3.loadModel(inputPath)
     recalculateTangentsOfModel(model)
     m3.saveAndInvalidateModel(model, outputPath)
 
+def convertIfChanged(inputPath, outputPath, tolerance=0.0):
+    """ Recalculates the tangents of a m3 file and returns the largest change of a tangent component.
+
+    The output file gets only written if the change is greater than tolerance. It gets written
+    into a temporary file which gets then renamed, so the output path can be the input path.
+    """
+    model = m3.loadModel(inputPath)
+    vertices = m3.vertexArray(model)
+    oldVertices = vertices.copy()
+    recalculateTangentsOfVertexArray(vertices, facesOfDivisions(model.divisions))
+    change = tangentChangeOf(oldVertices, vertices)
+    if change <= tolerance:
+        return change
+    outputDirectory = os.path.dirname(outputPath)
+    if outputDirectory != "":
+        os.makedirs(outputDirectory, exist_ok=True)
+    temporaryPath = outputPath + ".tmp"
+    try:
+        # The model was valid when it got loaded, only the vertex bytes changed
+        m3.saveAndInvalidateModel(model, temporaryPath, validate="serialize")
+        os.replace(temporaryPath, outputPath)
+    except BaseException:
+        if os.path.exists(temporaryPath):
+            os.remove(temporaryPath)
+        raise
+    return change
+
+def processFile(inputFilePath, outputFilePath, tolerance, continueAtErrors):
+    """ Returns the paths and the largest tangent change or None if the file could not be processed """
+    try:
+        change = convertIfChanged(inputFilePath, outputFilePath, tolerance)
+    except Exception as e:
+        if not continueAtErrors:
+            raise
+        # written at once so that the reports of parallel jobs don't interleave
+        sys.stderr.write("\nError: %s\n\nFile: %s\nTrace: %s\n" % (e, inputFilePath, traceback.format_exc()))
+        change = None
+    return inputFilePath, outputFilePath, change
+
+def findModelFiles(paths, recurse):
+    """ Yields the m3 files of the paths together with the directory relative to which they got found """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield os.path.dirname(path), path
+            continue
+        for directory, subdirectories, fileNames in os.walk(path):
+            for fileName in sorted(fileNames):
+                if fileName.endswith(".m3"):
+                    yield path, os.path.join(directory, fileName)
+            if not recurse:
+                break
+
+def outputFilePathFor(inputRoot, inputFilePath, outputDirectory):
+    if outputDirectory == None:
+        return inputFilePath
+    return os.path.join(outputDirectory, os.path.relpath(inputFilePath, inputRoot))
+
+def processFiles(paths, outputDirectory, recurse, tolerance=0.0, continueAtErrors=False, jobs=1):
+    """ Recalculates the tangents of the m3 files; outputDirectory None rewrites the files in place.
+
+    Returns the number of rewritten, unchanged and failed files. With jobs > 1 that
+    many files get processed in parallel processes.
+    """
+    filePathPairs = [(inputFilePath, outputFilePathFor(inputRoot, inputFilePath, outputDirectory)) for inputRoot, inputFilePath in findModelFiles(paths, recurse)]
+    if jobs > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+        futures = [executor.submit(processFile, inputFilePath, outputFilePath, tolerance, continueAtErrors) for inputFilePath, outputFilePath in filePathPairs]
+        results = (future.result() for future in concurrent.futures.as_completed(futures))
+    else:
+        executor = None
+        results = (processFile(inputFilePath, outputFilePath, tolerance, continueAtErrors) for inputFilePath, outputFilePath in filePathPairs)
+
+    rewritten, unchanged, failed = 0, 0, 0
+    try:
+        for inputFilePath, outputFilePath, change in results:
+            if change == None:
+                failed += 1
+            elif change > tolerance:
+                rewritten += 1
+                print("%s -> %s (tangents changed by up to %.3f)" % (inputFilePath, outputFilePath, change))
+            else:
+                unchanged += 1
+                print("%s unchanged (tangents changed by up to %.3f)" % (inputFilePath, change))
+    except BaseException:
+        if executor != None:
+            for future in futures:
+                future.cancel()
+        raise
+    finally:
+        if executor != None:
+            executor.shutdown()
+    return rewritten, unchanged, failed
+
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Convert Starcraft II m3 models to xml format.')
-    parser.add_argument('inputPath',  help="A *.m3 file")
-    parser.add_argument('outputPath', help="A *.m3 file")
+    parser = argparse.ArgumentParser(description='Recalculates the tangents of Starcraft II m3 models.',
+        epilog="Without --in-place and --output-directory exactly an input and an output file are expected.")
+    parser.add_argument('path', nargs='+', help="*.m3 files or directories with *.m3 files")
+    parser.add_argument('-o', '--output-directory',
+        help='Directory in which the m3 files with changed tangents get placed')
+    parser.add_argument('-i', '--in-place',
+        action='store_true', default=False,
+        help='Replace the m3 files with changed tangents')
+    parser.add_argument('-r', '--recurse',
+        action='store_true', default=False,
+        help='Process the m3 files of subdirectories too')
+    parser.add_argument('-t', '--tolerance',
+        type=float, default=0.0,
+        help='Write only files in which a tangent component or sign changed by more than this (default 0)')
+    parser.add_argument('-c', '--continue-at-errors',
+        action='store_true', default=False,
+        help='Continue if there are errors in the files')
+    parser.add_argument('-j', '--jobs',
+        type=int, default=1,
+        help='Number of files to process in parallel (0 = one per CPU core)')
     args = parser.parse_args()
-    
-    convert(args.inputPath, args.outputPath)
\ No newline at end of file
+
+    if not args.in_place and args.output_directory == None:
+        if len(args.path) != 2 or os.path.isdir(args.path[0]):
+            sys.stderr.write("Expected an input and an output file, or --in-place or --output-directory\n")
+            sys.exit(2)
+        convert(args.path[0], args.path[1])
+        sys.exit(0)
+    if args.in_place and args.output_directory != None:
+        sys.stderr.write("--in-place and --output-directory can't be combined\n")
+        sys.exit(2)
+
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+    rewritten, unchanged, failed = processFiles(args.path, args.output_directory, args.recurse, args.tolerance, args.continue_at_errors, jobs)
+    print("%d files rewritten, %d unchanged, %d failed" % (rewritten, unchanged, failed))
+    if failed > 0:
+        sys.exit(1)
@@ -24,6 +24,7 @@ import sys
 import os.path
 import argparse
 import time
+import fileWatcher
 
 modelFileName = sys.argv[1]
 
@@ -34,27 +35,22 @@ class ChangeLogCreator:
         self.logFileName = logFileName
     
     def createChangeLog(self):
-        self.logFile = open(self.logFileName, "w")
-        try:
+        with open(self.logFileName, "w") as self.logFile, fileWatcher.FileWatcher([self.modelFileName], lambda fileName: False) as watcher:
             previousModelModiticationTime = os.path.getmtime(self.modelFileName)
             self.log("Log file started at %s" % time.ctime(previousModelModiticationTime))
             previousModel = m3.loadModel(self.modelFileName, checkExpectedValue=False)
             while True:
+                watcher.waitForChanges()
                 currentModelModificationTime = os.path.getmtime(self.modelFileName)
-                if currentModelModificationTime > previousModelModiticationTime:
-                    self.log("")
-                    self.log("File modified at %s" % time.ctime(currentModelModificationTime))
-                    currentModel = m3.loadModel(self.modelFileName)
-                    self.changedAnimationIds = 0
-                    self.compareM3Structures(previousModel, currentModel, "model")
-                    if self.changedAnimationIds > 0:
-                        self.log("%d animation ids have changed!" % self.changedAnimationIds)
-                    previousModelModiticationTime = currentModelModificationTime
-                    previousModel = currentModel
-                time.sleep(0.1)
-        finally:
-           self.logFile.close()
-                
+                self.log("")
+                self.log("File modified at %s" % time.ctime(currentModelModificationTime))
+                currentModel = m3.loadModel(self.modelFileName)
+                self.changedAnimationIds = 0
+                self.compareM3Structures(previousModel, currentModel, "model")
+                if self.changedAnimationIds > 0:
+                    self.log("%d animation ids have changed!" % self.changedAnimationIds)
+                previousModel = currentModel
+
     def compareM3Structures(self, previous, current, structurePath):
         previousType = previous.structureDescription
         currentType = current.structureDescription
@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+import os
+import sys
+import time
+import select
+import struct
+import ctypes
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CLOEXEC = 0o2000000
+# wd, mask, cookie and length of the name that follows
+inotifyEventHeader = struct.Struct("iIII")
+
+def loadInotifyFunctions():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        return libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError, TypeError):
+        return None
+
+class FileWatcher:
+    """ Reports which of the watched files got changed.
+
+    The paths can be files or directories; of a directory all files accepted by
+    fileFilter get watched. inotify gets used if available, otherwise the
+    modification times get polled every pollInterval seconds. Changes get
+    collected until there was no further change for debounceDelay seconds,
+    so that a burst of writes results in a single report.
+    """
+
+    def __init__(self, paths, fileFilter, debounceDelay=0.3, pollInterval=0.5, usePolling=False):
+        self.fileFilter = fileFilter
+        self.debounceDelay = debounceDelay
+        self.pollInterval = pollInterval
+        self.watchedFiles = set()
+        self.watchedDirectories = set()
+        for path in paths:
+            if os.path.isdir(path):
+                self.watchedDirectories.add(os.path.normpath(path))
+            else:
+                self.watchedFiles.add(os.path.normpath(path))
+
+        self.inotifyFileDescriptor = None
+        if not usePolling:
+            self.inotifyFileDescriptor = self.startInotify()
+        if self.inotifyFileDescriptor == None:
+            self.modificationTimes = self.scanModificationTimes()
+
+    def usesInotify(self):
+        return self.inotifyFileDescriptor != None
+
+    def isWatched(self, filePath):
+        if filePath in self.watchedFiles:
+            return True
+        directory, fileName = os.path.split(filePath)
+        return (directory or ".") in self.watchedDirectories and self.fileFilter(fileName)
+
+    def startInotify(self):
+        inotifyFunctions = loadInotifyFunctions()
+        if inotifyFunctions == None:
+            return None
+        inotifyInit, inotifyAddWatch = inotifyFunctions
+        fileDescriptor = inotifyInit(IN_CLOEXEC)
+        if fileDescriptor < 0:
+            return None
+        # Files get watched via their directory, since editors often replace a file by renaming a new one
+        directories = self.watchedDirectories | set(os.path.dirname(f) or "." for f in self.watchedFiles)
+        self.directoriesOfWatches = {}
+        for directory in directories:
+            watchDescriptor = inotifyAddWatch(fileDescriptor, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO)
+            if watchDescriptor < 0:
+                os.close(fileDescriptor)
+                return None
+            self.directoriesOfWatches[watchDescriptor] = directory
+        return fileDescriptor
+
+    def close(self):
+        if self.inotifyFileDescriptor != None:
+            os.close(self.inotifyFileDescriptor)
+            self.inotifyFileDescriptor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, exceptionValue, traceback):
+        self.close()
+
+    def waitForChanges(self):
+        """ Blocks until watched files got changed and returns their paths as set """
+        if self.inotifyFileDescriptor == None:
+            return self.pollForChanges()
+        changedFiles = set()
+        while True:
+            timeout = self.debounceDelay if changedFiles else None
+            readable, writable, exceptional = select.select([self.inotifyFileDescriptor], [], [], timeout)
+            if not readable:
+                return changedFiles
+            changedFiles.update(self.readInotifyEvents())
+
+    def readInotifyEvents(self):
+        data = os.read(self.inotifyFileDescriptor, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            watchDescriptor, mask, cookie, nameLength = inotifyEventHeader.unpack_from(data, offset)
+            offset += inotifyEventHeader.size
+            name = os.fsdecode(data[offset:offset + nameLength].rstrip(b"\0"))
+            offset += nameLength
+            directory = self.directoriesOfWatches.get(watchDescriptor)
+            if directory == None or name == "":
+                continue
+            filePath = os.path.normpath(os.path.join(directory, name))
+            if self.isWatched(filePath):
+                yield filePath
+
+    def scanModificationTimes(self):
+        modificationTimes = {}
+        filePaths = set(self.watchedFiles)
+        for directory in self.watchedDirectories:
+            for fileName in os.listdir(directory):
+                if self.fileFilter(fileName):
+                    filePaths.add(os.path.normpath(os.path.join(directory, fileName)))
+        for filePath in filePaths:
+            try:
+                modificationTimes[filePath] = os.stat(filePath).st_mtime_ns
+            except OSError:
+                pass
+        return modificationTimes
+
+    def pollForChanges(self):
+        changedFiles = set()
+        while True:
+            time.sleep(self.debounceDelay if changedFiles else self.pollInterval)
+            modificationTimes = self.scanModificationTimes()
+            newlyChangedFiles = set(f for f, t in modificationTimes.items() if self.modificationTimes.get(f) != t)
+            self.modificationTimes = modificationTimes
+            if newlyChangedFiles:
+                changedFiles.update(newlyChangedFiles)
+            elif changedFiles:
+                return changedFiles
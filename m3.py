@@ -24,6 +24,18 @@ from xml.dom.minidom import Node
 import re
 from sys import stderr
 import struct
+import mmap
+import pickle
+import copyreg
+import collections.abc
+import hashlib
+import io
+import os
+import sys
+import time
+
+# numpy is optional and gets imported by importNumpy when it's needed, since importing it takes long
+numpy = None
 
 def increaseToValidSectionSize(size):
     blockSize = 16
@@ -35,31 +47,79 @@ def increaseToValidSectionSize(size):
         return size
 
 class Section:
-    """Has fields indexEntry and structureDescription and sometimes also the fields rawBytes and content """
+    """Has fields indexEntry and structureDescription and sometimes also the fields rawBytes and content
+    
+    Sections of lazily loaded files determine their content on first access of the content field.
+    The references within the content get resolved at that time too. The content of their U8__
+    sections, and with numpyArrays of the other primitive sections, is a read-only view of the
+    MappedFile in mappedFile.
+    """
     
     def __init__(self):
         self.timesReferenced = 0
+        self.lazyLoadParameters = None
+        self.lazyReferenceList = None
+        self.rawBytes = None
+        self.mappedFile = None
+        self.referencesToContent = None
+
+    @property
+    def content(self):
+        if self.lazyLoadParameters != None:
+            sections, checkExpectedValue, numpyArrays, instrumentation = self.lazyLoadParameters
+            self.determineContentField(checkExpectedValue, numpyArrays, instrumentation)
+            # Reset before resolving, so that references back to this section don't decode it again:
+            self.lazyLoadParameters = None
+            self.resolveReferences(sections)
+        return self._content
+
+    @content.setter
+    def content(self, content):
+        self._content = content
+        self.lazyLoadParameters = None
+
+    def determineContentFieldLazily(self, sections, checkExpectedValue, numpyArrays=False, instrumentation=None):
+        self.lazyLoadParameters = (sections, checkExpectedValue, numpyArrays, instrumentation)
+
+    def contentForReference(self):
+        """ Returns the content or, if it hasn't been determined yet, a LazyReferenceList for it """
+        if self.lazyLoadParameters != None and not self.structureDescription.isPrimitive:
+            if self.lazyReferenceList is None:
+                self.lazyReferenceList = LazyReferenceList(self)
+            return self.lazyReferenceList
+        return self.content
     
-    def determineContentField(self, checkExpectedValue):
+    def determineContentField(self, checkExpectedValue, numpyArrays=False, instrumentation=None):
         indexEntry = self.indexEntry
-        self.content = self.structureDescription.createInstances(buffer=self.rawBytes, count=indexEntry.repetitions, checkExpectedValue=checkExpectedValue)
+        startTime = time.perf_counter()
+        copy = self.mappedFile == None
+        self._content = self.structureDescription.createInstances(buffer=self.rawBytes, count=indexEntry.repetitions, checkExpectedValue=checkExpectedValue, numpyArrays=numpyArrays, copy=copy)
+        if instrumentation != None:
+            instrumentation.sectionDecoded(self, time.perf_counter() - startTime)
 
     def determineFieldRawBytes(self):
-        minRawBytes = self.determineRawBytesWithData()
-        if len(minRawBytes) != self.bytesRequiredForContent():
-            raise Exception("Section size calculation failed: Expected %s but was %s for %s; content: %s" % (self.bytesRequiredForContent(), len(minRawBytes), self.structureDescription.structureName, minRawBytes))
-        sectionSize = increaseToValidSectionSize(len(minRawBytes))
-        if len(minRawBytes) == sectionSize:
-            self.rawBytes = minRawBytes
-        else:
-            rawBytes = bytearray(sectionSize)
-            rawBytes[0:len(minRawBytes)] = minRawBytes
-            for i in range(len(minRawBytes),sectionSize):
-                rawBytes[i] = 0xaa
-            self.rawBytes = rawBytes
-            
-    def determineRawBytesWithData(self):
-        return self.structureDescription.instancesToBytes(self.content)
+        rawBytes = bytearray(increaseToValidSectionSize(self.bytesRequiredForContent()))
+        self.writeContentToBuffer(memoryview(rawBytes), 0)
+        self.rawBytes = rawBytes
+    
+    def writeContentToBuffer(self, buffer, offset):
+        """ Writes the content followed by the 0xaa padding bytes and returns the offset behind the section """
+        bytesRequired = self.bytesRequiredForContent()
+        dataEndOffset = self.structureDescription.writeInstancesToBuffer(self.content, buffer, offset)
+        if dataEndOffset - offset != bytesRequired:
+            raise Exception("Section size calculation failed: Expected %s but was %s for %s" % (bytesRequired, dataEndOffset - offset, self.structureDescription.structureName))
+        sectionEndOffset = offset + increaseToValidSectionSize(bytesRequired)
+        buffer[dataEndOffset:sectionEndOffset] = b"\xaa" * (sectionEndOffset - dataEndOffset)
+        return sectionEndOffset
+    
+    def writeToBuffer(self, buffer):
+        """ Writes the section at the offset of its index entry; sections with rawBytes get written unchanged """
+        offset = self.indexEntry.offset
+        if self.rawBytes != None:
+            endOffset = offset + len(self.rawBytes)
+            buffer[offset:endOffset] = self.rawBytes
+            return endOffset
+        return self.writeContentToBuffer(buffer, offset)
     
     def bytesRequiredForContent(self):
         return self.structureDescription.countBytesRequiredForInstances(self.content)
@@ -69,11 +129,151 @@ class Section:
             for object in self.content:
                 object.resolveReferences(sections)
 
+    def addReferenceToContent(self, owner, fieldName):
+        """ Remembers the fields which reference a LazyReferenceList or a view of the mapped file,
+        so that they can be set to the decoded list or to a copy of the view later """
+        isLazyReference = self.lazyReferenceList is not None and self.lazyLoadParameters != None
+        if isLazyReference or (self.mappedFile != None and self.structureDescription.isPrimitive):
+            if self.referencesToContent == None:
+                self.referencesToContent = []
+            self.referencesToContent.append((owner, fieldName))
+
+    def detachFromMappedFile(self):
+        """ Replaces the views of the mapped file by copies """
+        if self.lazyLoadParameters != None:
+            self.rawBytes = bytes(self.rawBytes)
+        else:
+            content = getattr(self, "_content", None)
+            if isinstance(content, memoryview) or (isNumpyArray(content) and content.base is not None):
+                contentCopy = bytearray(content) if isinstance(content, memoryview) else content.copy()
+                for owner, fieldName in self.referencesToContent or []:
+                    if getattr(owner, fieldName) is content:
+                        setattr(owner, fieldName, contentCopy)
+                self._content = contentCopy
+                if isinstance(content, memoryview):
+                    content.release()
+                self.referencesToContent = None
+            self.rawBytes = None
+        self.mappedFile = None
+
+class MappedFile:
+    """ The memory map of a lazily loaded file, see openLazyModel.
+
+    close() replaces the views of the map which the model references by copies and lets the sections
+    which haven't been decoded yet keep a copy of their bytes, so the model stays usable. Afterwards
+    the file can be overwritten, e.g. by saving the model to it. Views of the map which got
+    referenced elsewhere must have been released before, otherwise close raises a BufferError.
+    """
+
+    def __init__(self, source):
+        self.fileMap = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buffer = memoryview(self.fileMap)
+        self.sections = []
+
+    def close(self):
+        if self.fileMap == None:
+            return
+        for section in self.sections:
+            section.detachFromMappedFile()
+        self.sections = []
+        self.buffer.release()
+        self.fileMap.close()
+        self.fileMap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, exceptionValue, traceback):
+        self.close()
+
+
+class LazyReferenceList(collections.abc.MutableSequence):
+    """ Stands for the list of structures in a lazily loaded section.
+    
+    The content of the section gets determined on the first access of the list. The fields which
+    referenced this object get then set to the decoded list, so that all references to the section
+    share it. This object delegates to that list, so references to it kept elsewhere stay valid.
+    """
+    __hash__ = None
+    
+    def __init__(self, section):
+        self.section = section
+        self.items = None
+    
+    def load(self):
+        """ Returns the decoded list """
+        if self.items is None:
+            section = self.section
+            self.section = None
+            self.items = section.content
+            for owner, fieldName in section.referencesToContent or []:
+                if getattr(owner, fieldName) is self:
+                    setattr(owner, fieldName, self.items)
+            section.referencesToContent = None
+        return self.items
+    
+    def __len__(self):
+        return len(self.load())
+    
+    def __getitem__(self, index):
+        return self.load()[index]
+    
+    def __setitem__(self, index, value):
+        self.load()[index] = value
+    
+    def __delitem__(self, index):
+        del self.load()[index]
+    
+    def insert(self, index, value):
+        self.load().insert(index, value)
+    
+    def __iter__(self):
+        return iter(self.load())
+    
+    def __eq__(self, other):
+        if isinstance(other, LazyReferenceList):
+            other = other.load()
+        return self.load() == other
+    
+    def __add__(self, other):
+        return self.load() + list(other)
+    
+    def __radd__(self, other):
+        return list(other) + self.load()
+    
+    def sort(self, *args, **kwargs):
+        self.load().sort(*args, **kwargs)
+    
+    def copy(self):
+        return list(self.load())
+    
+    def __repr__(self):
+        return repr(self.load())
+
+def listOrLoadedList(value):
+    """ Returns the decoded list for a LazyReferenceList and the value itself otherwise """
+    if isinstance(value, LazyReferenceList):
+        return value.load()
+    return value
+
 
 primitiveFieldTypeSizes = {"uint32":4,"int32":4,"uint16":2,"int16":2, "uint8":1, "int8":1, "float":4, "tag":4, "fixed8": 1}
 primitiveFieldTypeFormats = {"uint32":"I","int32":"i","uint16":"H","int16":"h", "uint8":"B", "int8":"b" , "float":"f", "tag":"4s", "fixed8": "B"}
 intTypes = {"uint32","int32","uint16","int16", "uint8", "int8"}
 
+def importNumpy(purpose):
+    global numpy
+    if numpy == None:
+        try:
+            import numpy
+        except ImportError:
+            raise Exception("numpy is required %s" % purpose)
+    return numpy
+
+def isNumpyArray(value):
+    numpyModule = sys.modules.get("numpy")
+    return numpyModule != None and isinstance(value, numpyModule.ndarray)
+
 structureNamesOfPrimitiveTypes = set(["CHAR", "U8__", "REAL", "I16_", "U16_", "I32_", "U32_", "FLAG"])
 
 class M3StructureHistory:
@@ -151,30 +351,106 @@ class M3StructureDescription:
             nameToFieldMap[field.name] = field
         self.nameToFieldMap = nameToFieldMap
 
+        self.compileStructFormat()
+        self.dataType = None
+        self.structureClass = None
+        self.fieldsWithReferences = None
+        self.fieldsWithAnimationHeaders = None
+        self.referenceFieldPaths = None
+
+    def compileStructFormat(self):
+        """ Compiles one struct.Struct which covers all fields of the structure.
+
+        Embedded structures and references get flattened into the format, so that
+        a whole instance can be read with a single unpack_from call.
+        """
+        structFormatString = ""
+        valueCount = 0
+        for field in self.fields:
+            structFormatString += field.structFormatString
+            valueCount += field.valueCount
+        self.structFormatString = structFormatString
+        self.structFormat = struct.Struct("<" + structFormatString)
+        self.valueCount = valueCount
+        if self.structFormat.size != self.size:
+            raise Exception("The compiled format of %s in version %d has size %d instead of %d" % (self.structureName, self.structureVersion, self.structFormat.size, self.size))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Generated classes can't be pickled, they get created again on demand:
+        state["structureClass"] = None
+        return state
+
+    def getFieldsWithReferences(self):
+        """ Returns the reference fields and the embedded structure fields which contain references """
+        if self.fieldsWithReferences == None:
+            self.fieldsWithReferences = [field for field in self.fields if isinstance(field, ReferenceField) or (isinstance(field, EmbeddedStructureField) and field.structureDescription.hasReferences())]
+        return self.fieldsWithReferences
+    
+    def hasReferences(self):
+        return len(self.getFieldsWithReferences()) > 0
+
+    def getFieldsWithAnimationHeaders(self):
+        """ Returns the embedded structure and structure reference fields which can contain AnimationReferenceHeader structures """
+        if self.fieldsWithAnimationHeaders == None:
+            self.fieldsWithAnimationHeaders = [field for field in self.fields if field.canContainAnimationHeaders()]
+        return self.fieldsWithAnimationHeaders
+
+    def canContainAnimationHeaders(self):
+        return self.structureName == "AnimationReferenceHeader" or len(self.getFieldsWithAnimationHeaders()) > 0
+
+    def getReferenceFieldPaths(self):
+        """ Returns a map from the offsets of the references within the structure to the names of their fields """
+        if self.referenceFieldPaths == None:
+            referenceFieldPaths = {}
+            offset = 0
+            for field in self.fields:
+                if isinstance(field, ReferenceField):
+                    referenceFieldPaths[offset] = field.name
+                elif isinstance(field, EmbeddedStructureField):
+                    for embeddedOffset, fieldPath in field.structureDescription.getReferenceFieldPaths().items():
+                        referenceFieldPaths[offset + embeddedOffset] = field.name + "." + fieldPath
+                offset += field.size
+            self.referenceFieldPaths = referenceFieldPaths
+        return self.referenceFieldPaths
+
+    def getStructureClass(self):
+        """ Returns the M3Structure subclass whose instances are structures of this version """
+        if self.structureClass == None:
+            self.structureClass = StructureClassGenerator(self).generate()
+        return self.structureClass
+
     def createInstance(self, buffer=None, offset=0, checkExpectedValue=True):
-        return M3Structure(self, buffer, offset, checkExpectedValue)
+        return self.getStructureClass()(buffer, offset, checkExpectedValue)
+
+    def createInstanceFromValues(self, values, checkExpectedValue=True):
+        """ values needs to be a tuple which has been unpacked with structFormat """
+        return self.getStructureClass().createFromValues(values, checkExpectedValue)
 
-    def createInstances(self, buffer, count, checkExpectedValue=True):
+    def createInstances(self, buffer, count, checkExpectedValue=True, numpyArrays=False, copy=True):
+        """ Primitive sections like REAL or U16_ get returned as numpy arrays if numpyArrays is True
+        
+        If copy is False, U8__ sections and numpy arrays are views of the buffer instead of copies.
+        """
         if self.isPrimitive:
             if self.structureName == "CHAR":
-                return buffer[:count-1].decode("ASCII")
+                return str(buffer[:count-1], "ASCII")
             elif self.structureName == "U8__":
+                if not copy:
+                    return memoryview(buffer)[:count]
                 return bytearray(buffer[:count])
+            elif numpyArrays:
+                importNumpy("to load %s sections as arrays" % self.structureName)
+                array = numpy.frombuffer(buffer, dtype=self.numpyDataType(), count=count)
+                # Copy, so that the array is writable like a list would be:
+                return array.copy() if copy else array
             else:
-                structFormat = self.fields[0].structFormat
-                list = []
-                for offset in range(0, count*self.size, self.size):
-                    bytesOfOneEntry = buffer[offset:(offset+self.size)]
-                    intValue = structFormat.unpack(bytesOfOneEntry)[0]
-                    list.append(intValue)
-                return list
+                elementFormatString = self.fields[0].structFormatString
+                return list(struct.unpack_from("<%d%s" % (count, elementFormatString), buffer))
         else:
-            list = []
-            instanceOffset = 0
-            for i in range(count):
-                list.append(self.createInstance(buffer=buffer, offset=instanceOffset, checkExpectedValue=checkExpectedValue));
-                instanceOffset += self.size
-            return list
+            bytesOfInstances = memoryview(buffer)[:count*self.size]
+            createFromValues = self.getStructureClass().createFromValues
+            return [createFromValues(values, checkExpectedValue) for values in self.structFormat.iter_unpack(bytesOfInstances)]
     
     def dumpOffsets(self):
         offset = 0
@@ -183,6 +459,23 @@ class M3StructureDescription:
             stderr.write("%s: %s\n" % (offset, field.name))
             offset += field.size
 
+    def numpyDataType(self):
+        """ Returns the numpy dtype of the structure.
+
+        For primitive structures like REAL or U16_ it's the type of a single element.
+        For other structures it's a structured dtype with one entry per field.
+        Fixed8 fields are contained in it as the uint8 values in which they got stored.
+        """
+        if self.dataType == None:
+            importNumpy("to determine the dtype of %s" % self.structureName)
+            if self.isPrimitive:
+                self.dataType = numpy.dtype("<" + self.fields[0].structFormatString)
+            else:
+                self.dataType = numpy.dtype([(field.name, field.numpyDataType()) for field in self.fields])
+                if self.dataType.itemsize != self.size:
+                    raise Exception("The dtype of %s in version %d has size %d instead of %d" % (self.structureName, self.structureVersion, self.dataType.itemsize, self.size))
+        return self.dataType
+
     def countInstances(self, instances):
         if self.structureName == "CHAR":
             if instances == None:
@@ -202,32 +495,71 @@ class M3StructureDescription:
                 raise
             field.validateContent(fieldContent, instanceName + "." + field.name);
 
+    def validateStructureOf(self, instance, instanceName):
+        """ Validates only the fields which become sections or contain such fields, but not the primitive values """
+        for field in self.getFieldsWithReferences():
+            field.validateStructure(getattr(instance, field.name), instanceName + "." + field.name)
+
+    def validateValuesOf(self, instance, instanceName):
+        """ Validates the fields which are no references; works also after the references got replaced by index references """
+        for field in self.fields:
+            fieldContent = getattr(instance, field.name)
+            fieldPath = instanceName + "." + field.name
+            if isinstance(field, EmbeddedStructureField):
+                field.structureDescription.validateValuesOf(fieldContent, fieldPath)
+            elif not isinstance(field, ReferenceField):
+                field.validateContent(fieldContent, fieldPath)
+
     def hasField(self, fieldName):
         return fieldName in self.nameToFieldMap
 
     def instancesToBytes(self, instances):
+        rawBytes = bytearray(self.countBytesRequiredForInstances(instances))
+        self.writeInstancesToBuffer(instances, memoryview(rawBytes), 0)
+        return rawBytes
+    
+    def writeInstancesToBuffer(self, instances, buffer, offset):
+        """ Writes the instances into the buffer at the given offset and returns the offset behind them.
+        
+        The buffer should be a memoryview, so that writing beyond its end fails instead of enlarging it.
+        """
         if self.structureName == "CHAR":
             if type(instances) != str:
                 raise Exception("Expected a string but it was a %s" % type(instances))
-            return instances.encode("ASCII") + b'\x00'
+            encodedString = instances.encode("ASCII") + b'\x00'
+            endOffset = offset + len(encodedString)
+            buffer[offset:endOffset] = encodedString
+            return endOffset
         elif self.structureName == "U8__":
-            if type(instances) != bytes and type(instances) != bytearray:
+            if type(instances) != bytes and type(instances) != bytearray and type(instances) != memoryview:
                 raise Exception("Expected a byte array but it was a %s" % type(instances))
-            return instances
-        else:
-            rawBytes = bytearray(self.size * len(instances))
-            offset = 0
-            
-            if self.isPrimitive:
-                structFormat = self.fields[0].structFormat
-                for value in instances:
-                    structFormat.pack_into(rawBytes, offset,value)
-                    offset += self.size
+            endOffset = offset + len(instances)
+            buffer[offset:endOffset] = instances
+            return endOffset
+        elif self.isPrimitive:
+            if isNumpyArray(instances):
+                importNumpy("to write %s arrays" % self.structureName)
+                numpy.frombuffer(buffer, dtype=self.numpyDataType(), count=len(instances), offset=offset)[:] = instances
             else:
+                elementFormatString = self.fields[0].structFormatString
+                try:
+                    struct.pack_into("<%d%s" % (len(instances), elementFormatString), buffer, offset, *instances)
+                except struct.error as e:
+                    raise Exception("A list of %s could not be written: %s" % (self.structureName, e))
+            return offset + self.size * len(instances)
+        else:
+            startOffset = offset
+            try:
                 for value in instances:
-                    value.writeToBuffer(rawBytes, offset)
+                    value.writeToBuffer(buffer, offset)
                     offset += self.size
-            return rawBytes
+            except (struct.error, TypeError, AttributeError, UnicodeEncodeError) as e:
+                # Determine which field caused the error since the values did not get validated before
+                instanceIndex = (offset - startOffset) // self.size
+                instanceName = "%sV%d[%d]" % (self.structureName, self.structureVersion, instanceIndex)
+                self.validateValuesOf(instances[instanceIndex], instanceName)
+                raise Exception("%s could not be written: %s" % (instanceName, e))
+            return offset
     
     def countBytesRequiredForInstances(self, instances):
         if self.structureName == "CHAR":
@@ -238,20 +570,21 @@ class M3StructureDescription:
 
 
 class M3Structure:
+    """ Base class of the classes which StructureClassGenerator creates for each structure version.
     
-    def __init__(self, structureDescription, buffer=None, offset=0, checkExpectedValue=True):
-        self.structureDescription = structureDescription
-
+    The generated classes have the class attribute structureDescription, a slot for each field and
+    the methods readFromValues, toValues, writeToBuffer, setFieldsToDefault and createFromValues.
+    """
+    __slots__ = ()
+    
+    def __init__(self, buffer=None, offset=0, checkExpectedValue=True):
         if buffer != None:
             self.readFromBuffer(buffer, offset, checkExpectedValue)
         else:
-            for field in self.structureDescription.fields:
-                field.setToDefault(self)
-            
-        
+            self.setFieldsToDefault()
         
     def introduceIndexReferences(self, indexMaker):
-        for field in self.structureDescription.fields:
+        for field in self.structureDescription.getFieldsWithReferences():
             field.introduceIndexReferences(self, indexMaker)
     
     def resolveReferences(self, sections):
@@ -259,18 +592,8 @@ class M3Structure:
             field.resolveIndexReferences(self, sections)
         
     def readFromBuffer(self, buffer, offset, checkExpectedValue):
-        fieldOffset = offset
-        for field in self.structureDescription.fields:
-            field.readFromBuffer(self, buffer, fieldOffset, checkExpectedValue)
-            fieldOffset += field.size
-        assert fieldOffset - offset == self.structureDescription.size
-    
-    def writeToBuffer(self, buffer, offset):
-        fieldOffset = offset
-        for field in self.structureDescription.fields:
-            field.writeToBuffer(self, buffer, fieldOffset)
-            fieldOffset += field.size
-        assert fieldOffset - offset == self.structureDescription.size
+        values = self.structureDescription.structFormat.unpack_from(buffer, offset)
+        self.readFromValues(values, checkExpectedValue)
         
     def __str__(self):
         fieldValueMap = {}
@@ -292,24 +615,154 @@ class M3Structure:
      
      
      
+class StructureClassGenerator:
+    """ Generates the M3Structure subclass of a structure description.
+    
+    The methods of the class get generated as source code, so that every field
+    gets read, written and initialized without a dispatch over the field list.
+    Fields without a specialized code snippet fall back to their own methods.
+    """
+    
+    def __init__(self, structureDescription):
+        self.structureDescription = structureDescription
+        self.namespace = {"M3Structure": M3Structure}
+        
+    def constant(self, value, prefix):
+        name = "%s%d" % (prefix, len(self.namespace))
+        self.namespace[name] = value
+        return name
+
+    def generate(self):
+        structureDescription = self.structureDescription
+        fieldNames = tuple(field.name for field in structureDescription.fields)
+        for fieldName in fieldNames:
+            if hasattr(M3Structure, fieldName) or fieldName == "structureDescription":
+                raise Exception("The field name %s of %s can't be used as attribute" % (fieldName, structureDescription.structureName))
+        className = "%sV%d" % (structureDescription.structureName, structureDescription.structureVersion)
+        structureClass = type(className, (M3Structure,), {"__slots__": fieldNames, "structureDescription": structureDescription})
+        self.namespace["structureClass"] = structureClass
+        self.namespace["packInto"] = structureDescription.structFormat.pack_into
+        
+        readLines = self.readLines()
+        valueExpressions = self.valueExpressions()
+        defaultLines = self.defaultLines()
+        
+        source = "def readFromValues(self, values, checkExpectedValue):\n"
+        source += "".join("    %s\n" % line for line in readLines)
+        source += "def createFromValues(values, checkExpectedValue=True):\n"
+        source += "    self = M3Structure.__new__(structureClass)\n"
+        source += "".join("    %s\n" % line for line in readLines)
+        source += "    return self\n"
+        source += "def toValues(self):\n"
+        source += "    return (%s)\n" % "".join(expression + ", " for expression in valueExpressions)
+        source += "def writeToBuffer(self, buffer, offset):\n"
+        source += "    packInto(buffer, offset%s)\n" % "".join(", " + expression for expression in valueExpressions)
+        source += "def setFieldsToDefault(self):\n"
+        source += "".join("    %s\n" % line for line in defaultLines)
+        exec(compile(source, "<generated %s>" % className, "exec"), self.namespace)
+        
+        structureClass.readFromValues = self.namespace["readFromValues"]
+        structureClass.createFromValues = staticmethod(self.namespace["createFromValues"])
+        structureClass.toValues = self.namespace["toValues"]
+        structureClass.writeToBuffer = self.namespace["writeToBuffer"]
+        structureClass.setFieldsToDefault = self.namespace["setFieldsToDefault"]
+        return structureClass
+    
+    def readLines(self):
+        fields = self.structureDescription.fields
+        if all(field.isSimpleValue() for field in fields):
+            if len(fields) == 0:
+                return ["pass"]
+            return ["(%s) = values" % "".join("self.%s, " % field.name for field in fields)]
+        lines = []
+        valueIndex = 0
+        for field in fields:
+            if field.isSimpleValue():
+                lines.append("self.%s = values[%d]" % (field.name, valueIndex))
+            elif isinstance(field, Fixed8Field) and field.expectedValue == None:
+                lines.append("self.%s = values[%d] / 255.0 * 2.0 - 1" % (field.name, valueIndex))
+            elif isinstance(field, (EmbeddedStructureField, ReferenceField)):
+                structureClass = field.embeddedStructureDescription().getStructureClass()
+                createFromValues = self.constant(structureClass.createFromValues, "create")
+                lines.append("self.%s = %s(values[%d:%d], checkExpectedValue)" % (field.name, createFromValues, valueIndex, valueIndex + field.valueCount))
+            else:
+                fieldConstant = self.constant(field, "field")
+                lines.append("%s.readFromValues(self, values, %d, checkExpectedValue)" % (fieldConstant, valueIndex))
+            valueIndex += field.valueCount
+        return lines
+    
+    def valueExpressions(self):
+        expressions = []
+        for field in self.structureDescription.fields:
+            if isinstance(field, (PrimitiveField, UnknownBytesField)) and not isinstance(field, Fixed8Field):
+                expressions.append("self.%s" % field.name)
+            elif isinstance(field, Fixed8Field):
+                expressions.append("round((self.%s+1) / 2.0 * 255.0)" % field.name)
+            elif isinstance(field, (EmbeddedStructureField, ReferenceField)):
+                expressions.append("*self.%s.toValues()" % field.name)
+            else:
+                fieldConstant = self.constant(field, "field")
+                expressions.append("*%s.valuesOf(self)" % fieldConstant)
+        return expressions
+    
+    def defaultLines(self):
+        lines = []
+        for field in self.structureDescription.fields:
+            if isinstance(field, (PrimitiveField, UnknownBytesField)):
+                defaultValue = self.constant(field.defaultValue, "default")
+                lines.append("self.%s = %s" % (field.name, defaultValue))
+            elif isinstance(field, EmbeddedStructureField):
+                structureClass = self.constant(field.structureDescription.getStructureClass(), "structureClass")
+                lines.append("self.%s = %s()" % (field.name, structureClass))
+            else:
+                fieldConstant = self.constant(field, "field")
+                lines.append("%s.setToDefault(self)" % fieldConstant)
+        if len(lines) == 0:
+            lines.append("pass")
+        return lines
+
+
 class Field:
+    """ Subclasses define the attributes size, structFormatString and valueCount.
+
+    structFormatString is the part of the struct format which describes the field
+    and valueCount the number of values that format produces when it gets unpacked.
+    """
     def __init__(self, name, sinceVersion, tillVersion):
         self.name = name
         self.sinceVersion = sinceVersion
         self.tillVersion = tillVersion
 
+    def isSimpleValue(self):
+        """ Returns true if the unpacked value can be used without conversion or checks """
+        return False
+
+    def readFromValues(self, owner, values, valueIndex, checkExpectedValue):
+        setattr(owner, self.name, values[valueIndex])
+
+    def valuesOf(self, owner):
+        return (getattr(owner, self.name),)
+
+    def numpyDataType(self):
+        return numpy.dtype("<" + self.structFormatString)
+
     def introduceIndexReferences(self, owner, indexMaker):
         pass
 
     def resolveIndexReferences(self, owner, sections):
         pass
 
+    def canContainAnimationHeaders(self):
+        return False
+
 
 class TagField(Field):
 
     def __init__(self, name, sinceVersion, tillVersion):
         Field.__init__(self, name, sinceVersion, tillVersion)
         self.structFormat = struct.Struct("<4B")
+        self.structFormatString = "4s"
+        self.valueCount = 1
         self.size = 4
     
     def readFromBuffer(self, owner, buffer, offset, checkExpectedValue):
@@ -320,6 +773,14 @@ class TagField(Field):
             s = chr(b[3]) + chr(b[2]) + chr(b[1]) + chr(b[0])
         
         setattr(owner, self.name, s)
+
+    def readFromValues(self, owner, values, valueIndex, checkExpectedValue):
+        b = values[valueIndex]
+        if b[3] == 0:
+            s = b[2::-1].decode("latin-1")
+        else:
+            s = b[::-1].decode("latin-1")
+        setattr(owner, self.name, s)
     
     def writeToBuffer(self, owner, buffer, offset):
         s = getattr(owner, self.name)
@@ -329,6 +790,17 @@ class TagField(Field):
             b = (s[2] + s[1] + s[0]).encode("ascii") + b"\x00"
         return self.structFormat.pack_into(buffer, offset, b[0], b[1], b[2], b[3])
 
+    def numpyDataType(self):
+        return numpy.dtype("S4")
+
+    def valuesOf(self, owner):
+        s = getattr(owner, self.name)
+        if len(s) == 4:
+            b = (s[3] + s[2] + s[1] + s[0]).encode("ascii")
+        else:
+            b = (s[2] + s[1] + s[0]).encode("ascii") + b"\x00"
+        return (b,)
+
     def setToDefault(self, owner):
         pass
     
@@ -342,14 +814,25 @@ class ReferenceField(Field):
         self.referenceStructureDescription = referenceStructureDescription
         self.historyOfReferencedStructures = historyOfReferencedStructures
         self.size = referenceStructureDescription.size
+        self.structFormatString = referenceStructureDescription.structFormatString
+        self.valueCount = referenceStructureDescription.valueCount
+
+    def validateReferencedContent(self, fieldContent, fieldPath):
+        """ Validates the field content without the structures it contains """
+        self.validateContent(fieldContent, fieldPath)
+
+    def validateStructure(self, fieldContent, fieldPath):
+        self.validateReferencedContent(fieldContent, fieldPath)
 
     def introduceIndexReferences(self, owner, indexMaker):
-        referencedObjects = getattr(owner, self.name)
+        referencedObjects = listOrLoadedList(getattr(owner, self.name))
+        if indexMaker.validateReferences:
+            self.validateReferencedContent(referencedObjects, owner.structureDescription.structureName + "." + self.name)
         structureDescription = self.getListContentStructureDefinition(referencedObjects, "while adding index ref")
         
         indexReference = indexMaker.getIndexReferenceTo(referencedObjects, self.referenceStructureDescription, structureDescription)
         isPrimitive = self.historyOfReferencedStructures != None and self.historyOfReferencedStructures.isPrimitive 
-        if not isPrimitive:
+        if not isPrimitive and structureDescription != None and structureDescription.hasReferences():
             for referencedObject in referencedObjects:
                 referencedObject.introduceIndexReferences(indexMaker)
         setattr(owner, self.name, indexReference)
@@ -371,7 +854,8 @@ class ReferenceField(Field):
             if indexEntry.repetitions < ref.entries:
                 raise Exception("%s tries to reference %s elements in a %s section that contains just %s element(s)" % (variable, ref.entries, indexEntry.tag, indexEntry.repetitions))
 
-            referencedObjects = referencedSection.content
+            referencedObjects = referencedSection.contentForReference()
+            referencedSection.addReferenceToContent(owner, self.name)
             if self.historyOfReferencedStructures != None:
                 expectedTagName = self.historyOfReferencedStructures.name
                 actualTagName = indexEntry.tag
@@ -384,6 +868,7 @@ class ReferenceField(Field):
     
 
     def getListContentStructureDefinition(self, l, contextString):
+        l = listOrLoadedList(l)
 
         if self.historyOfReferencedStructures == None:
             if len(l) == 0:
@@ -395,14 +880,14 @@ class ReferenceField(Field):
         if self.historyOfReferencedStructures.isPrimitive:
             return self.historyOfReferencedStructures.getVersion(0)
         
-        if type(l) != list:
+        if not isinstance(l, list):
             raise Exception("%s: Expected a list, but was a %s" % (contextString,type(l)))
         if len(l) == 0:
             return None
         
         firstElement = l[0]
         contentClass = type(firstElement)
-        if contentClass != M3Structure:
+        if not issubclass(contentClass, M3Structure):
             raise Exception("%s: Expected a list to contain an M3Structure object and not a %s" % (contextString, contentClass))
         # Optional: Enable check:
         #if not contentClass.tagName == tagName:
@@ -412,11 +897,25 @@ class ReferenceField(Field):
     def readFromBuffer(self, owner, buffer, offset, checkExpectedValue):
         referenceObject = self.referenceStructureDescription.createInstance(buffer, offset, checkExpectedValue)
         setattr(owner, self.name, referenceObject)
+
+    def readFromValues(self, owner, values, valueIndex, checkExpectedValue):
+        referenceValues = values[valueIndex:valueIndex + self.valueCount]
+        referenceObject = self.referenceStructureDescription.createInstanceFromValues(referenceValues, checkExpectedValue)
+        setattr(owner, self.name, referenceObject)
  
     def writeToBuffer(self, owner, buffer, offset):
         referenceObject = getattr(owner, self.name)
         referenceObject.writeToBuffer(buffer, offset)
 
+    def valuesOf(self, owner):
+        return getattr(owner, self.name).toValues()
+
+    def embeddedStructureDescription(self):
+        return self.referenceStructureDescription
+
+    def numpyDataType(self):
+        return self.referenceStructureDescription.numpyDataType()
+
     def setToDefault(self, owner):
         
         if self.historyOfReferencedStructures != None:
@@ -444,7 +943,8 @@ class ByteReferenceField(ReferenceField):
         ReferenceField.__init__(self, name, referenceStructureDescription, historyOfReferencedStructures, sinceVersion, tillVersion)
 
     def validateContent(self, fieldContent, fieldPath):
-        if (type(fieldContent) != bytearray):
+        # Lazily loaded models reference the bytes as memoryview of the mapped file
+        if (type(fieldContent) != bytearray) and (type(fieldContent) != memoryview):
             raise Exception("%s is not a bytearray but a %s" % (fieldPath, type(fieldContent)))
 
 
@@ -454,6 +954,10 @@ class RealReferenceField(ReferenceField):
         ReferenceField.__init__(self, name, referenceStructureDescription, historyOfReferencedStructures, sinceVersion, tillVersion)
 
     def validateContent(self, fieldContent, fieldPath):
+        if isNumpyArray(fieldContent):
+            if fieldContent.ndim != 1 or fieldContent.dtype.kind != "f":
+                raise Exception("%s is not a one dimensional array of floats" % (fieldPath))
+            return
         if (type(fieldContent) != list):\
             raise Exception("%s is not a list of float" % (fieldPath))
         for itemIndex, item in enumerate(fieldContent):
@@ -461,6 +965,10 @@ class RealReferenceField(ReferenceField):
                 itemPath = "%s[%d]" % (fieldPath, itemIndex)
                 raise Exception("%s is not an float" % (itemPath))
 
+    def validateReferencedContent(self, fieldContent, fieldPath):
+        if not (isNumpyArray(fieldContent) or type(fieldContent) == list):
+            raise Exception("%s is not a list of float" % (fieldPath))
+
     
 class IntReferenceField(ReferenceField):
     intRefToMinValue = {"I16_":(-(1<<15)), "U16_":0, "I32_":(-(1<<31)), "U32_":0, "FLAG":0}
@@ -472,6 +980,15 @@ class IntReferenceField(ReferenceField):
         self.maxValue = IntReferenceField.intRefToMaxValue[historyOfReferencedStructures.name]
         
     def validateContent(self, fieldContent, fieldPath):
+        if isNumpyArray(fieldContent):
+            if fieldContent.ndim != 1 or fieldContent.dtype.kind not in ("i", "u"):
+                raise Exception("%s is not a one dimensional array of integers" % (fieldPath))
+            if len(fieldContent) > 0:
+                minItem = int(fieldContent.min())
+                maxItem = int(fieldContent.max())
+                if (minItem < self.minValue) or (maxItem > self.maxValue):
+                    raise Exception("%s contains values in range [%d, %d] which is not within [%s, %s]"  % (fieldPath, minItem, maxItem, self.minValue, self.maxValue))
+            return
         if (type(fieldContent) != list):
             raise Exception("%s is not a list of integers" % (fieldPath))
         for itemIndex, item in enumerate(fieldContent):
@@ -481,6 +998,10 @@ class IntReferenceField(ReferenceField):
             if (item < self.minValue) or (item > self.maxValue):
                 raise Exception("%s has value %d which is not in range [%s, %s]"  % (itemPath, item, self.minValue, self.maxValue))
 
+    def validateReferencedContent(self, fieldContent, fieldPath):
+        if not (isNumpyArray(fieldContent) or type(fieldContent) == list):
+            raise Exception("%s is not a list of integers" % (fieldPath))
+
 
 class StructureReferenceField(ReferenceField):
     
@@ -488,15 +1009,33 @@ class StructureReferenceField(ReferenceField):
         ReferenceField.__init__(self, name, referenceStructureDescription, historyOfReferencedStructures, sinceVersion, tillVersion)
 
     def validateContent(self, fieldContent, fieldPath):
-        if (type(fieldContent) != list):
-            raise Exception("%s is not a list, but a %s" % (fieldPath, type(fieldContent)))
-        if len(fieldContent) > 0:
-            structureDescription = self.getListContentStructureDefinition(fieldContent, fieldPath)
-            if structureDescription.history != self.historyOfReferencedStructures:
-                raise Exception("Expected that %s is a list of %s and not %s" % (fieldPath, self.historyOfReferencedStructures.name, structureDescription.history.name))
+        structureDescription = self.validateReferencedContent(fieldContent, fieldPath)
+        if structureDescription != None:
             for itemIndex, item in enumerate(fieldContent):
                 structureDescription.validateInstance(item, "%s[%d]" % (fieldPath, itemIndex))
 
+    def validateReferencedContent(self, fieldContent, fieldPath):
+        """ Checks that the content is a list of the referenced structure and returns the structure description of the items """
+        fieldContent = listOrLoadedList(fieldContent)
+        if not isinstance(fieldContent, list):
+            raise Exception("%s is not a list, but a %s" % (fieldPath, type(fieldContent)))
+        if len(fieldContent) == 0:
+            return None
+        structureDescription = self.getListContentStructureDefinition(fieldContent, fieldPath)
+        if structureDescription.history != self.historyOfReferencedStructures:
+            raise Exception("Expected that %s is a list of %s and not %s" % (fieldPath, self.historyOfReferencedStructures.name, structureDescription.history.name))
+        return structureDescription
+
+    def validateStructure(self, fieldContent, fieldPath):
+        structureDescription = self.validateReferencedContent(fieldContent, fieldPath)
+        if structureDescription != None and structureDescription.hasReferences():
+            for itemIndex, item in enumerate(fieldContent):
+                structureDescription.validateStructureOf(item, "%s[%d]" % (fieldPath, itemIndex))
+
+    def canContainAnimationHeaders(self):
+        history = self.historyOfReferencedStructures
+        return any(history.getVersion(version).canContainAnimationHeaders() for version in history.versionToSizeMap)
+
 class UnknownReferenceField(ReferenceField):
     
     def __init__(self, name, referenceStructureDescription, historyOfReferencedStructures, sinceVersion, tillVersion):
@@ -512,11 +1051,16 @@ class EmbeddedStructureField(Field):
         Field.__init__(self, name, sinceVersion, tillVersion)
         self.structureDescription = structureDescription
         self.size = structureDescription.size
+        self.structFormatString = structureDescription.structFormatString
+        self.valueCount = structureDescription.valueCount
         
     def introduceIndexReferences(self, owner, indexMaker):
         emeddedStructure = getattr(owner, self.name)
         emeddedStructure.introduceIndexReferences(indexMaker)
 
+    def canContainAnimationHeaders(self):
+        return self.structureDescription.canContainAnimationHeaders()
+
     def resolveIndexReferences(self, owner, sections):
         emeddedStructure = getattr(owner, self.name)
         emeddedStructure.resolveReferences(sections)
@@ -529,11 +1073,25 @@ class EmbeddedStructureField(Field):
         
         referenceObject = self.structureDescription.createInstance(buffer, offset, checkExpectedValue)
         setattr(owner, self.name, referenceObject)
+
+    def readFromValues(self, owner, values, valueIndex, checkExpectedValue):
+        embeddedValues = values[valueIndex:valueIndex + self.valueCount]
+        embeddedStructure = self.structureDescription.createInstanceFromValues(embeddedValues, checkExpectedValue)
+        setattr(owner, self.name, embeddedStructure)
     
     def writeToBuffer(self, owner, buffer, offset):
         emeddedStructure = getattr(owner, self.name)
         emeddedStructure.writeToBuffer(buffer, offset)
 
+    def valuesOf(self, owner):
+        return getattr(owner, self.name).toValues()
+
+    def embeddedStructureDescription(self):
+        return self.structureDescription
+
+    def numpyDataType(self):
+        return self.structureDescription.numpyDataType()
+
     def setToDefault(self, owner):
         v = self.structureDescription.createInstance()
         setattr(owner, self.name, v)
@@ -541,6 +1099,9 @@ class EmbeddedStructureField(Field):
     def validateContent(self, fieldContent, fieldPath):
         self.structureDescription.validateInstance(fieldContent,fieldPath)
 
+    def validateStructure(self, fieldContent, fieldPath):
+        self.structureDescription.validateStructureOf(fieldContent, fieldPath)
+
 
 class PrimitiveField(Field):
     """ Base class for IntField and FloatField """
@@ -548,13 +1109,24 @@ class PrimitiveField(Field):
     def __init__(self, name, typeString, sinceVersion, tillVersion, defaultValue, expectedValue):
         Field.__init__(self, name, sinceVersion, tillVersion)
         self.size = primitiveFieldTypeSizes[typeString]
-        self.structFormat = struct.Struct("<" + primitiveFieldTypeFormats[typeString])
+        self.structFormatString = primitiveFieldTypeFormats[typeString]
+        self.structFormat = struct.Struct("<" + self.structFormatString)
+        self.valueCount = 1
         self.typeString = typeString
         self.defaultValue = defaultValue
         self.expectedValue = expectedValue
 
+    def isSimpleValue(self):
+        return self.expectedValue == None
+
     def readFromBuffer(self, owner, buffer, offset, checkExpectedValue):
         value = self.structFormat.unpack_from(buffer, offset)[0]
+        self.checkAndSetValue(owner, value)
+
+    def readFromValues(self, owner, values, valueIndex, checkExpectedValue):
+        self.checkAndSetValue(owner, values[valueIndex])
+
+    def checkAndSetValue(self, owner, value):
         if self.expectedValue != None and value != self.expectedValue:
             structureName = owner.structureDescription.structureName
             structureVersion = owner.structureDescription.structureVersion
@@ -615,8 +1187,17 @@ class Fixed8Field(PrimitiveField):
     def __init__(self, name, typeString, sinceVersion, tillVersion, defaultValue, expectedValue):
         PrimitiveField.__init__(self, name, typeString, sinceVersion, tillVersion, defaultValue, expectedValue)
 
+    def isSimpleValue(self):
+        return False
+
     def readFromBuffer(self, owner, buffer, offset, checkExpectedValue):
         intValue = self.structFormat.unpack_from(buffer, offset)[0]
+        self.convertAndSetValue(owner, intValue, checkExpectedValue)
+
+    def readFromValues(self, owner, values, valueIndex, checkExpectedValue):
+        self.convertAndSetValue(owner, values[valueIndex], checkExpectedValue)
+
+    def convertAndSetValue(self, owner, intValue, checkExpectedValue):
         floatValue =  ((intValue / 255.0 * 2.0) -1) 
         
         if checkExpectedValue and self.expectedValue != None and floatValue != self.expectedValue:
@@ -629,6 +1210,10 @@ class Fixed8Field(PrimitiveField):
         floatValue = getattr(owner, self.name)
         intValue = round((floatValue+1) / 2.0 * 255.0)
         return self.structFormat.pack_into(buffer, offset, intValue)
+
+    def valuesOf(self, owner):
+        floatValue = getattr(owner, self.name)
+        return (round((floatValue+1) / 2.0 * 255.0),)
     
     
     def validateContent(self, fieldContent, fieldPath):
@@ -641,13 +1226,27 @@ class UnknownBytesField(Field):
     def __init__(self, name, size, sinceVersion, tillVersion, defaultValue, expectedValue):
         Field.__init__(self, name, sinceVersion, tillVersion)
         self.size = size
-        self.structFormat = struct.Struct("<%ss" % size)
+        self.structFormatString = "%ss" % size
+        self.structFormat = struct.Struct("<" + self.structFormatString)
+        self.valueCount = 1
         self.defaultValue = defaultValue
         self.expectedValue = expectedValue
         assert self.structFormat.size == self.size
 
+    def isSimpleValue(self):
+        return self.expectedValue == None
+
     def readFromBuffer(self, owner, buffer, offset, checkExpectedValue):
         value = self.structFormat.unpack_from(buffer, offset)[0]
+        self.checkAndSetValue(owner, value, checkExpectedValue)
+
+    def readFromValues(self, owner, values, valueIndex, checkExpectedValue):
+        self.checkAndSetValue(owner, values[valueIndex], checkExpectedValue)
+
+    def numpyDataType(self):
+        return numpy.dtype("V%d" % self.size)
+
+    def checkAndSetValue(self, owner, value, checkExpectedValue):
         if checkExpectedValue and self.expectedValue != None and value != self.expectedValue:
             raise Exception("Expected that %sV%s.%s has always the value %s, but it was %s" % (owner.structureDescription.structureName, owner.structureDescription.structureVersion, self.name, self.expectedValue, value))
 
@@ -799,8 +1398,7 @@ class BitAttributesReader(Visitor):
 
 class ExpectedAndDefaultConstantsDeterminer(Visitor):
     def parseHex(self, hexString):
-        hexString = hexString[2:]
-        return bytes([int(hexString[x:x+2], 16) for x in range(0, len(hexString),2)])
+        return bytes.fromhex(hexString[2:])
         
     def visitFieldStart(self, generalDataMap, classDataMap, fieldDataMap):
         structureName = classDataMap["structureName"]
@@ -1081,21 +1679,214 @@ def resolveAllReferences(list, sections):
             for entry in sublist:
                 entry.resolveReferences(sections)
 
-def loadSections(filename, checkExpectedValue=True):
+class PhaseTimer:
+    def __init__(self, instrumentation, phaseName):
+        self.instrumentation = instrumentation
+        self.phaseName = phaseName
+
+    def __enter__(self):
+        self.startTime = time.perf_counter()
+
+    def __exit__(self, exceptionType, exceptionValue, traceback):
+        self.instrumentation.addPhaseTime(self.phaseName, time.perf_counter() - self.startTime)
+
+class Instrumentation:
+    """ Gets informed by loadModel, loadSections, saveSections and saveAndInvalidateModel about their progress.
+    
+    This base class ignores the information; PhaseProfile collects it.
+    """
+    
+    def phase(self, phaseName):
+        """ Returns a context manager which measures the time of the phase with the given name """
+        return PhaseTimer(self, phaseName)
+    
+    def addPhaseTime(self, phaseName, seconds):
+        pass
+    
+    def sectionDecoded(self, section, seconds):
+        pass
+    
+    def addBytesRead(self, numberOfBytes):
+        pass
+    
+    def addBytesWritten(self, numberOfBytes):
+        pass
+
+class PhaseProfile(Instrumentation):
+    """ Collects the wall time per phase, the decode time and instance count per structure and the read and written bytes """
+    
+    def __init__(self):
+        self.phaseTimes = {}
+        self.sectionStatistics = {}
+        self.bytesRead = 0
+        self.bytesWritten = 0
+    
+    def addPhaseTime(self, phaseName, seconds):
+        self.phaseTimes[phaseName] = self.phaseTimes.get(phaseName, 0.0) + seconds
+    
+    def sectionDecoded(self, section, seconds):
+        self.addPhaseTime("decode sections", seconds)
+        key = "%sV%d" % (section.indexEntry.tag, section.indexEntry.version)
+        statistics = self.sectionStatistics.get(key)
+        if statistics == None:
+            statistics = {"sections": 0, "instances": 0, "bytes": 0, "seconds": 0.0}
+            self.sectionStatistics[key] = statistics
+        statistics["sections"] += 1
+        statistics["instances"] += section.indexEntry.repetitions
+        statistics["bytes"] += len(section.rawBytes)
+        statistics["seconds"] += seconds
+    
+    def addBytesRead(self, numberOfBytes):
+        self.bytesRead += numberOfBytes
+    
+    def addBytesWritten(self, numberOfBytes):
+        self.bytesWritten += numberOfBytes
+    
+    def report(self, maxStructures=10):
+        """ Returns a text with the phase times and the structures which took the longest to decode """
+        lines = []
+        for phaseName, seconds in self.phaseTimes.items():
+            lines.append("%-24s %9.3f s" % (phaseName, seconds))
+        if self.bytesRead > 0:
+            lines.append("%-24s %9d" % ("bytes read", self.bytesRead))
+        if self.bytesWritten > 0:
+            lines.append("%-24s %9d" % ("bytes written", self.bytesWritten))
+        slowestStructures = sorted(self.sectionStatistics.items(), key=lambda item: item[1]["seconds"], reverse=True)
+        for key, statistics in slowestStructures[:maxStructures]:
+            lines.append("  decode %-15s %9.3f s %9d instances in %d sections" % (key, statistics["seconds"], statistics["instances"], statistics["sections"]))
+        return "\n".join(lines)
+
+def readHeaderAndIndex(source, checkExpectedValue=True, instrumentation=None):
+    """ Reads the MD34 header and the MD34IndexEntry structures from the given binary file object """
+    MD34V11 = structures["MD34"].getVersion(11)
+    source.seek(0)
+    headerBytes = source.read(MD34V11.size)
+    header = MD34V11.createInstance(headerBytes, checkExpectedValue=checkExpectedValue)
+    
+    source.seek(header.indexOffset)
+    MD34IndexEntryV0 = structures["MD34IndexEntry"].getVersion(0)
+    indexBytes = source.read(MD34IndexEntryV0.size * header.indexSize)
+    if instrumentation != None:
+        instrumentation.addBytesRead(len(headerBytes) + len(indexBytes))
+    indexEntries = MD34IndexEntryV0.createInstances(indexBytes, header.indexSize, checkExpectedValue)
+    return header, indexEntries
+
+class MetadataReader:
+    """ Reads the header and the index of a m3 file and decodes only the sections needed for the requested paths.
+    
+    The references of the decoded structures don't get resolved. Paths like "model.sequences[*].name"
+    follow them on demand, so that reading it decodes only the MODL, SEQS and CHAR sections it needs.
+    A path starts with "model" and each further segment names a field, optionally followed by [*] to
+    select all elements or [n] to select the n-th element of the referenced list.
+    """
+    pathSegmentPattern = re.compile(r"^(\w+)(?:\[(\*|\d+)\])?$")
+    
+    def __init__(self, filename, checkExpectedValue=False):
+        self.checkExpectedValue = checkExpectedValue
+        self.sectionContents = {}
+        self.source = open(filename, "rb")
+        try:
+            self.header, self.indexEntries = readHeaderAndIndex(self.source, checkExpectedValue)
+            self.fileMap = mmap.mmap(self.source.fileno(), 0, access=mmap.ACCESS_READ)
+        except:
+            self.source.close()
+            raise
+    
+    def close(self):
+        self.fileMap.close()
+        self.source.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exceptionType, exceptionValue, traceback):
+        self.close()
+    
+    def sectionContent(self, sectionIndex):
+        content = self.sectionContents.get(sectionIndex)
+        if content == None:
+            indexEntry = self.indexEntries[sectionIndex]
+            structureHistory = structures.get(indexEntry.tag)
+            if structureHistory == None:
+                raise Exception("The section %d has the unknown structure %s" % (sectionIndex, indexEntry.tag))
+            structureDescription = structureHistory.getVersion(indexEntry.version)
+            sectionBytes = self.fileMap[indexEntry.offset:indexEntry.offset + structureDescription.size * indexEntry.repetitions]
+            content = structureDescription.createInstances(sectionBytes, indexEntry.repetitions, self.checkExpectedValue)
+            self.sectionContents[sectionIndex] = content
+        return content
+    
+    def model(self):
+        return self.sectionContent(self.header.model.index)[0]
+    
+    def fieldValue(self, structure, fieldName, path):
+        if not isinstance(structure, M3Structure):
+            raise Exception("%s: Can't get the field %s of a %s" % (path, fieldName, type(structure)))
+        field = structure.structureDescription.nameToFieldMap.get(fieldName)
+        if field == None:
+            raise Exception("%s: %s has no field %s" % (path, structure.structureDescription.structureName, fieldName))
+        value = getattr(structure, fieldName)
+        if not isinstance(field, ReferenceField):
+            return value
+        if value.entries == 0:
+            if field.historyOfReferencedStructures == None:
+                return []
+            return field.historyOfReferencedStructures.createEmptyArray()
+        return self.sectionContent(value.index)
+    
+    def read(self, path):
+        """ Returns the value at the path; a list of values if it selects elements with [*] """
+        segments = path.split(".")
+        if segments[0] != "model":
+            raise Exception("The path %s does not start with model" % path)
+        values = [self.model()]
+        selectsMultipleValues = False
+        for segment in segments[1:]:
+            match = self.pathSegmentPattern.match(segment)
+            if match == None:
+                raise Exception("%s: Invalid path segment %s" % (path, segment))
+            fieldName, selector = match.groups()
+            selectedValues = []
+            for value in values:
+                fieldValue = self.fieldValue(value, fieldName, path)
+                if selector == None:
+                    selectedValues.append(fieldValue)
+                elif selector == "*":
+                    selectedValues.extend(fieldValue)
+                    selectsMultipleValues = True
+                else:
+                    selectedValues.append(fieldValue[int(selector)])
+            values = selectedValues
+        if selectsMultipleValues:
+            return values
+        return values[0]
+
+def readModelPaths(filename, paths, checkExpectedValue=False):
+    """ Returns a map from each of the paths to its value, see MetadataReader for the path format """
+    with MetadataReader(filename, checkExpectedValue) as reader:
+        return dict((path, reader.read(path)) for path in paths)
+
+def loadSections(filename, checkExpectedValue=True, numpyArrays=False, lazy=False, instrumentation=None):
+    """ If lazy is True, the file gets memory mapped and the rawBytes of the sections are
+    memoryview slices of it. The content of a section gets then only determined on the first access.
+    The MappedFile is available via the mappedFile field of the sections; close it when the sections
+    are no longer needed.
+    
+    The instrumentation, if given, gets informed about the read bytes and the decoded sections, see Instrumentation.
+    """
+    if instrumentation == None:
+        instrumentation = Instrumentation()
     source = open(filename, "rb")
+    mappedFile = None
     try:
-        MD34V11 = structures["MD34"].getVersion(11)
-        headerBytes = source.read(MD34V11.size)
-        header = MD34V11.createInstance(headerBytes, checkExpectedValue=checkExpectedValue)
-        
-        source.seek(header.indexOffset)
-        MD34IndexEntryV0 = structures["MD34IndexEntry"].getVersion(0)
-        sections = []
-        for i in range(header.indexSize):
-            section = Section()
-            indexEntryBytes = source.read(MD34IndexEntryV0.size)
-            section.indexEntry = MD34IndexEntryV0.createInstance(indexEntryBytes, checkExpectedValue=checkExpectedValue)
-            sections.append(section)
+        if lazy:
+            mappedFile = MappedFile(source)
+        with instrumentation.phase("read header and index"):
+            header, indexEntries = readHeaderAndIndex(source, checkExpectedValue, instrumentation)
+            sections = []
+            for indexEntry in indexEntries:
+                section = Section()
+                section.indexEntry = indexEntry
+                sections.append(section)
         
         offsets = []
         for section in sections:
@@ -1112,9 +1903,17 @@ def loadSections(filename, checkExpectedValue=True):
         unknownSections = set()
         for section in sections:
             indexEntry = section.indexEntry
-            source.seek(indexEntry.offset)
             numberOfBytes = offsetToSizeMap[indexEntry.offset]
-            section.rawBytes = source.read(numberOfBytes)
+            if lazy:
+                section.rawBytes = mappedFile.buffer[indexEntry.offset:indexEntry.offset + numberOfBytes]
+                section.mappedFile = mappedFile
+                mappedFile.sections.append(section)
+            else:
+                startTime = time.perf_counter()
+                source.seek(indexEntry.offset)
+                section.rawBytes = source.read(numberOfBytes)
+                instrumentation.addPhaseTime("read sections", time.perf_counter() - startTime)
+                instrumentation.addBytesRead(numberOfBytes)
             
             structureHistory = structures.get(indexEntry.tag)
             if structureHistory != None:
@@ -1124,7 +1923,10 @@ def loadSections(filename, checkExpectedValue=True):
 
             if structureDescription != None:
                 section.structureDescription = structureDescription
-                section.determineContentField(checkExpectedValue)
+                if lazy:
+                    section.determineContentFieldLazily(sections, checkExpectedValue, numpyArrays, instrumentation)
+                else:
+                    section.determineContentField(checkExpectedValue, numpyArrays, instrumentation)
             else:
                 guessedUnusedSectionBytes = 0
                 for i in range (1,16):
@@ -1138,6 +1940,10 @@ def loadSections(filename, checkExpectedValue=True):
                 unknownSections.add("%sV%s" % (indexEntry.tag, indexEntry.version))
         if len(unknownSections) != 0:
             raise Exception("There were %s unknown sections: %s (see console log for more details)" % (len(unknownSections), unknownSections))
+    except:
+        if mappedFile != None:
+            mappedFile.close()
+        raise
     finally:
         source.close()
     return sections
@@ -1146,53 +1952,197 @@ def resolveReferencesOfSections(sections):
     for section in sections:
         section.resolveReferences(sections)
 
+def findReferenceCandidates(sections, referencedSectionIndices):
+    """ Searches all sections in a single pass for references with the entries and index values of the given sections.
+    
+    Only the offsets of reference fields get checked, so primitive sections get skipped. Returns a map
+    from each of the given section indices to a list of (section, offset, fieldPath, flags) tuples.
+    """
+    referenceFormat = struct.Struct("<III")
+    candidates = dict((sectionIndex, []) for sectionIndex in referencedSectionIndices)
+    for section in sections:
+        structureDescription = section.structureDescription
+        if structureDescription.isPrimitive:
+            continue
+        referenceFieldPaths = structureDescription.getReferenceFieldPaths().items()
+        rawBytes = section.rawBytes
+        for structureOffset in range(0, structureDescription.size * section.indexEntry.repetitions, structureDescription.size):
+            for fieldOffset, fieldPath in referenceFieldPaths:
+                offset = structureOffset + fieldOffset
+                entries, index, flags = referenceFormat.unpack_from(rawBytes, offset)
+                sectionCandidates = candidates.get(index)
+                if sectionCandidates != None and entries == sections[index].indexEntry.repetitions:
+                    sectionCandidates.append((section, offset, fieldPath, flags))
+    return candidates
+
 def checkThatAllSectionsGotReferenced(sections):
-    numberOfUnreferencedSections = 0
-    referenceStructureDescription = reference = structures["Reference"].getVersion(0)
-    for sectionIndex, section in enumerate(sections):
-        
-        if (section.timesReferenced == 0) and (sectionIndex != 0):
-            numberOfUnreferencedSections += 1
-            stderr.write("WARNING: %sV%s (%d repetitions) got %d times referenced\n" % (section.indexEntry.tag, section.indexEntry.version, section.indexEntry.repetitions , section.timesReferenced))
-            reference = referenceStructureDescription.createInstance()
-            reference.entries = section.indexEntry.repetitions
-            reference.index = sectionIndex
-            reference.flags = 0
-            bytesToSearch = referenceStructureDescription.instancesToBytes([reference])
-            possibleReferences = 0
-            for sectionToCheck in sections:
-                positionInSection = sectionToCheck.rawBytes.find(bytesToSearch)
-                if positionInSection != -1:
-                    possibleReferences += 1
-                    stderr.write("  -> Found a reference at offset %d in a section of type %sV%s\n" % (positionInSection % sectionToCheck.structureDescription.size, sectionToCheck.indexEntry.tag,sectionToCheck.indexEntry.version)) 
-                    sectionToCheck.structureDescription.dumpOffsets()
-
-            if possibleReferences == 0:
-                bytesToSearch = bytesToSearch[0:-4]
-                for sectionToCheck in sections:
-                    positionInSection = sectionToCheck.rawBytes.find(bytesToSearch)
-                    if positionInSection != -1:
-                        flagBytes = sectionToCheck.rawBytes[positionInSection+8:positionInSection+12]
-                        flagsAsHex = byteDataToHex(flagBytes)
-                        stderr.write("  -> Found maybe a reference at offset %d in a section of type %sV%s with flag %s\n" % (positionInSection, sectionToCheck.indexEntry.tag,sectionToCheck.indexEntry.version, flagsAsHex)) 
-                        sectionToCheck.structureDescription.dumpOffsets()
-
-    if numberOfUnreferencedSections > 0:
-        raise Exception("Unable to load all data: There were %d unreferenced sections. View log for details" % numberOfUnreferencedSections)
-
-def loadModel(filename, checkExpectedValue=True):
-    sections = loadSections(filename, checkExpectedValue)
-    resolveReferencesOfSections(sections)
-    checkThatAllSectionsGotReferenced(sections)
+    unreferencedSectionIndices = [i for i, section in enumerate(sections) if section.timesReferenced == 0 and i != 0]
+    if len(unreferencedSectionIndices) == 0:
+        return
+    candidates = findReferenceCandidates(sections, unreferencedSectionIndices)
+    for sectionIndex in unreferencedSectionIndices:
+        section = sections[sectionIndex]
+        stderr.write("WARNING: %sV%s (%d repetitions) got %d times referenced\n" % (section.indexEntry.tag, section.indexEntry.version, section.indexEntry.repetitions , section.timesReferenced))
+        for sectionToCheck, offset, fieldPath, flags in candidates[sectionIndex]:
+            structureSize = sectionToCheck.structureDescription.size
+            certainty = "a reference" if flags == 0 else "maybe a reference"
+            stderr.write("  -> Found %s in the field %s of the element %d of a section of type %sV%s with flags 0x%08x\n" % (certainty, fieldPath, offset // structureSize, sectionToCheck.indexEntry.tag, sectionToCheck.indexEntry.version, flags))
+
+    raise Exception("Unable to load all data: There were %d unreferenced sections. View log for details" % len(unreferencedSectionIndices))
+
+def vertexStructureDescriptionOf(model):
+    vertexClassName = "VertexFormat" + hex(model.vFlags)
+    if not vertexClassName in structures:
+        raise Exception("Vertex flags %s can't be handled yet" % hex(model.vFlags))
+    return structures[vertexClassName].getVersion(0)
+
+def vertexArray(model):
+    """ Returns the vertices of the model as numpy record array.
+
+    The array uses the memory of model.vertices, so changes to the array
+    change the vertices of the model. Fixed8 fields like the normal have
+    the uint8 values in which they got stored, see fixed8ToFloat.
+    """
+    importNumpy("to create a vertex array")
+    vertexStructureDescription = vertexStructureDescriptionOf(model)
+    numberOfVertices = len(model.vertices) // vertexStructureDescription.size
+    vertices = numpy.frombuffer(model.vertices, dtype=vertexStructureDescription.numpyDataType(), count=numberOfVertices)
+    return vertices.view(numpy.recarray)
+
+def regionFaceArrays(division):
+    """ Returns the triangles of the regions of a DIV_ structure as numpy int32 arrays of shape (n, 3).
+
+    The list contains an array per region in the order of division.regions. The face indices
+    get offset by the firstVertexIndex of the region, so they are indices into the vertices of the model.
+    """
+    importNumpy("to create face arrays")
+    faceIndices = numpy.asarray(division.faces, dtype=numpy.int32)
+    faceArrays = []
+    for regionIndex, region in enumerate(division.regions):
+        firstFaceVertexIndexIndex = region.firstFaceVertexIndexIndex
+        endFaceVertexIndexIndex = firstFaceVertexIndexIndex + region.numberOfFaceVertexIndices
+        if region.numberOfFaceVertexIndices % 3 != 0 or endFaceVertexIndexIndex > len(faceIndices):
+            raise Exception("Region %d references %d face vertex indices starting at %d, but the division has %d" % (regionIndex, region.numberOfFaceVertexIndices, firstFaceVertexIndexIndex, len(faceIndices)))
+        regionFaceIndices = faceIndices[firstFaceVertexIndexIndex:endFaceVertexIndexIndex]
+        faceArrays.append(regionFaceIndices.reshape(-1, 3) + numpy.int32(region.firstVertexIndex))
+    return faceArrays
+
+class AnimationHeaderIndex:
+    """ Indexes the AnimationReferenceHeader structures of a model by a key.
+
+    The model gets walked once, descending only into fields which can contain headers.
+    The key of a header consists of the field names on the way to it, e.g.
+    "bones[BONE:Bone01].rotation.header". List entries get identified by their structure
+    name together with their name if they have unique names and with their index otherwise.
+    That way the headers of bones, materials, lights and so on can be matched between
+    models via their keys, and headers of different structures never get matched.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.keyToHeaderMap = {}
+        self.addHeadersOf(model, "")
+
+    def addHeadersOf(self, structure, keyPrefix):
+        for field in structure.structureDescription.getFieldsWithAnimationHeaders():
+            fieldContent = getattr(structure, field.name)
+            key = keyPrefix + field.name
+            if isinstance(field, EmbeddedStructureField):
+                if fieldContent.structureDescription.structureName == "AnimationReferenceHeader":
+                    self.keyToHeaderMap[key] = fieldContent
+                else:
+                    self.addHeadersOf(fieldContent, key + ".")
+            else:
+                for itemKey, item in zip(self.itemKeysOf(fieldContent), fieldContent):
+                    structureName = item.structureDescription.structureName
+                    self.addHeadersOf(item, "%s[%s:%s]." % (key, structureName, itemKey))
+
+    def itemKeysOf(self, items):
+        if len(items) == 0 or not items[0].structureDescription.hasField("name"):
+            return range(len(items))
+        names = [item.name for item in items]
+        if None in names or len(set(names)) != len(names):
+            return range(len(items))
+        return names
+
+    def animIdMapTo(self, otherIndex, conflicts=None):
+        """ Returns a map from the anim ids of this index to the anim ids of the headers with the same keys in the other index
+
+        If an anim id would have to become several anim ids, the first mapping gets kept. For the
+        other headers a tuple of key, anim id, kept new anim id and wanted new anim id gets
+        appended to conflicts, if it's a list.
+        """
+        animIdMap = {}
+        for key, header in self.keyToHeaderMap.items():
+            otherHeader = otherIndex.keyToHeaderMap.get(key)
+            if otherHeader == None:
+                continue
+            newAnimId = animIdMap.setdefault(header.animId, otherHeader.animId)
+            if newAnimId != otherHeader.animId and conflicts != None:
+                conflicts.append((key, header.animId, newAnimId, otherHeader.animId))
+        return animIdMap
+
+    def remapAnimIds(self, animIdMap):
+        """ Replaces the anim ids of the headers and of the STC_ and STS_ anim id lists of the model """
+        for header in self.keyToHeaderMap.values():
+            header.animId = animIdMap.get(header.animId, header.animId)
+        animIdLists = [stc.animIds for stc in self.model.sequenceTransformationCollections] + [sts.animIds for sts in self.model.sts]
+        for animIds in animIdLists:
+            animIds[:] = [animIdMap.get(animId, animId) for animId in animIds]
+
+def fixed8ToFloat(intValues):
+    return intValues / 255.0 * 2.0 - 1.0
+
+def floatToFixed8(floatValues):
+    importNumpy("to convert floats to fixed8 values")
+    return numpy.round((floatValues + 1.0) / 2.0 * 255.0).astype(numpy.uint8)
+
+def loadModel(filename, checkExpectedValue=True, numpyArrays=False, lazy=False, instrumentation=None, validate=True):
+    """ If numpyArrays is True, non empty REAL, I16_, U16_, I32_, U32_ and FLAG references
+    like DIV_.faces or the frames of animation blocks get loaded as numpy arrays instead of lists.
+    
+    If lazy is True, the file gets memory mapped and only sections reachable from the model get decoded.
+    The check for unreferenced sections and the validation of the model get skipped in that mode.
+    The map gets closed when the model gets garbage collected; use openLazyModel to close it explicitly.
+    
+    If validate is False, the validation of the model gets skipped. That's useful if the file
+    got already validated or if the model gets validated anyway before it gets saved.
+    
+    Pass a PhaseProfile as instrumentation to find out where the time gets spent.
+    """
+    if instrumentation == None:
+        instrumentation = Instrumentation()
+    if lazy:
+        model, mappedFile = openLazyModel(filename, checkExpectedValue, numpyArrays, instrumentation)
+        return model
+    sections = loadSections(filename, checkExpectedValue, numpyArrays, lazy, instrumentation)
+    with instrumentation.phase("resolve references"):
+        resolveReferencesOfSections(sections)
+    with instrumentation.phase("check references"):
+        checkThatAllSectionsGotReferenced(sections)
     header = sections[0].content[0]
     model = header.model[0]
     modelDescription = model.structureDescription
-    modelDescription.validateInstance(model, "model")
+    if validate:
+        with instrumentation.phase("validate"):
+            modelDescription.validateInstance(model, "model")
     return model
 
+def openLazyModel(filename, checkExpectedValue=True, numpyArrays=False, instrumentation=None):
+    """ Loads the model lazily like loadModel and returns it together with its MappedFile.
+    
+    The byte arrays of the model like model.vertices and, if numpyArrays is True, the arrays
+    are read-only views of the map. Close the MappedFile, e.g. by using it as context manager,
+    before the file gets overwritten.
+    """
+    sections = loadSections(filename, checkExpectedValue, numpyArrays, lazy=True, instrumentation=instrumentation)
+    header = sections[0].content[0]
+    return header.model[0], sections[0].mappedFile
+
 class IndexReferenceSourceAndSectionListMaker:
     """ Creates a list of sections which are needed to store the objects for which index references are requested"""
-    def __init__(self):
+    def __init__(self, validateReferences=False):
+        self.validateReferences = validateReferences
         self.objectsIdToIndexReferenceMap = {}
         self.offset = 0
         self.nextFreeIndexPosition = 0
@@ -1232,53 +2182,132 @@ class IndexReferenceSourceAndSectionListMaker:
         return indexReference
     
     
-def modelToSections(model):
+def modelToSections(model, validateReferences=False):
     MD34V11 = structures["MD34"].getVersion(11)
     header = MD34V11.createInstance()
     header.tag = "MD34"
     header.model = [model]
     ReferenceV0 = structures["Reference"].getVersion(0)
-    indexMaker = IndexReferenceSourceAndSectionListMaker()
+    indexMaker = IndexReferenceSourceAndSectionListMaker(validateReferences)
     indexMaker.getIndexReferenceTo([header], ReferenceV0, MD34V11)
     header.introduceIndexReferences(indexMaker)
     sections = indexMaker.sections
     header.indexOffset = indexMaker.offset
     header.indexSize = len(sections)
-
-    for section in sections:
-        section.determineFieldRawBytes()
     return sections
 
-def saveSections(sections, filename):
-    fileObject = open(filename, "w+b")
+def sectionsToBytes(sections):
+    """ Serializes the sections and the index directly into a single buffer of the final file size """
+    header = sections[0].content[0]
+    indexEntrySize = structures["MD34IndexEntry"].getVersion(0).size
+    fileBytes = bytearray(header.indexOffset + indexEntrySize * len(sections))
+    buffer = memoryview(fileBytes)
     try:
+        offset = 0
         previousSection = None
         for section in sections:
-            if section.indexEntry.offset != fileObject.tell():
-                raise Exception("Section length problem: Section with index entry %(previousIndexEntry)s has length %(previousLength)s and gets followed by section with index entry %(currentIndexEntry)s" % {"previousIndexEntry":previousSection.indexEntry,"previousLength":len(previousSection.rawBytes),"currentIndexEntry":section.indexEntry} )
-            fileObject.write(section.rawBytes)
+            if section.indexEntry.offset != offset:
+                raise Exception("Section length problem: Section with index entry %(previousIndexEntry)s ends at %(offset)s and gets followed by section with index entry %(currentIndexEntry)s" % {"previousIndexEntry":previousSection.indexEntry,"offset":offset,"currentIndexEntry":section.indexEntry} )
+            offset = section.writeToBuffer(buffer)
             previousSection = section
-        header = sections[0].content[0]
-        if fileObject.tell() != header.indexOffset:
-            raise Exception("Not at expected write position %s after writing sections, but %s"%(header.indexOffset, fileObject.tell()))
+        if offset != header.indexOffset:
+            raise Exception("Not at expected write position %s after writing sections, but %s"%(header.indexOffset, offset))
         for section in sections:
-            indexEntryBytesBuffer = bytearray(section.indexEntry.structureDescription.size)
-            section.indexEntry.writeToBuffer(indexEntryBytesBuffer, 0)
-            fileObject.write(indexEntryBytesBuffer)
+            section.indexEntry.writeToBuffer(buffer, offset)
+            offset += indexEntrySize
     finally:
-        fileObject.close()
+        buffer.release()
+    return fileBytes
+
+def saveSections(sections, filename, instrumentation=None):
+    if instrumentation == None:
+        instrumentation = Instrumentation()
+    with instrumentation.phase("serialize sections"):
+        fileBytes = sectionsToBytes(sections)
+    with instrumentation.phase("write file"):
+        with open(filename, "wb") as fileObject:
+            fileObject.write(fileBytes)
+    instrumentation.addBytesWritten(len(fileBytes))
         
-def saveAndInvalidateModel(model, filename):
-    '''Do not use the model object after calling this method since it gets modified'''
-    model.structureDescription.validateInstance(model,"model")
-    sections = modelToSections(model)
-    saveSections(sections, filename)
+validationLevels = ["full", "structural", "serialize", "none"]
+
+def saveAndInvalidateModel(model, filename, validate="full", instrumentation=None):
+    '''Do not use the model object after calling this method since it gets modified
+    
+    The validate parameter determines how the model gets checked before it gets written:
+    "full" validates every field of every structure.
+    "structural" validates only the lists, strings and byte arrays which become sections.
+    "serialize" validates the same while the sections get created, within the same pass over the model.
+    "none" skips the validation.
+    Without a full validation an invalid primitive value gets only detected, when it can't be written.
+    The error names the field then too, but the model has already been modified at that point.
+    
+    Pass a PhaseProfile as instrumentation to find out where the time gets spent.
+    '''
+    if instrumentation == None:
+        instrumentation = Instrumentation()
+    with instrumentation.phase("validate"):
+        if validate == "full":
+            model.structureDescription.validateInstance(model,"model")
+        elif validate == "structural":
+            model.structureDescription.validateStructureOf(model, "model")
+        elif validate not in validationLevels:
+            raise Exception("Unknown validation level %s, expected one of %s" % (validate, validationLevels))
+    with instrumentation.phase("create sections"):
+        sections = modelToSections(model, validateReferences=(validate == "serialize"))
+    saveSections(sections, filename, instrumentation)
+
+structuresCacheFormatVersion = 1
+
+def determineStructuresCacheKey(structuresXmlPath):
+    """ The key changes if structures.xml or this module changes """
+    hash = hashlib.sha1()
+    for filePath in [structuresXmlPath, __file__]:
+        with open(filePath, "rb") as f:
+            hash.update(f.read())
+    return "%d-%s" % (structuresCacheFormatVersion, hash.hexdigest())
+
+def reduceStruct(structObject):
+    return (struct.Struct, (structObject.format,))
+
+def saveStructuresCache(structures, cacheKey, cachePath):
+    outputStream = io.BytesIO()
+    pickler = pickle.Pickler(outputStream, protocol=pickle.HIGHEST_PROTOCOL)
+    pickler.dispatch_table = copyreg.dispatch_table.copy()
+    pickler.dispatch_table[struct.Struct] = reduceStruct
+    pickler.dump(cacheKey)
+    pickler.dump(structures)
+    os.makedirs(os.path.dirname(cachePath), exist_ok=True)
+    temporaryCachePath = "%s.%d.tmp" % (cachePath, os.getpid())
+    with open(temporaryCachePath, "wb") as f:
+        f.write(outputStream.getvalue())
+    os.replace(temporaryCachePath, cachePath)
+
+def loadStructuresCache(cacheKey, cachePath):
+    """ Returns None if there is no cache for the given key """
+    try:
+        with open(cachePath, "rb") as f:
+            unpickler = pickle.Unpickler(f)
+            if unpickler.load() != cacheKey:
+                return None
+            return unpickler.load()
+    except Exception:
+        return None
 
 def readStructures():
-    from os import path
-    directory = path.dirname(__file__)
-    structuresXmlPath = path.join(directory, "structures.xml")
-    return readStructureDefinitions(structuresXmlPath)
+    """ Reads structures.xml or, if it didn't change, a cached copy of the parsed structures """
+    directory = os.path.dirname(__file__)
+    structuresXmlPath = os.path.join(directory, "structures.xml")
+    cachePath = os.path.join(directory, "__pycache__", "structures.cache")
+    cacheKey = determineStructuresCacheKey(structuresXmlPath)
+    structures = loadStructuresCache(cacheKey, cachePath)
+    if structures == None:
+        structures = readStructureDefinitions(structuresXmlPath)
+        try:
+            saveStructuresCache(structures, cacheKey, cachePath)
+        except (OSError, pickle.PicklingError) as e:
+            stderr.write("WARNING: Failed to cache the structure definitions: %s\n" % e)
+    return structures
 
 structures = readStructures()
     
\ No newline at end of file
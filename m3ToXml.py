@@ -25,12 +25,19 @@ import m3
 import argparse
 import os.path
 import os
-import io
+import gzip
+import concurrent.futures
 import time
 import traceback
 
-def byteDataToHex(byteData):
-    return '0x' + ''.join(["%02x" % x for x in byteData])
+def byteDataToHex(byteData, bytesPerLine=0, lineSeparator="\n"):
+    """ Returns the bytes as 0x prefixed hex string, wrapped after bytesPerLine bytes if it's not 0 """
+    hexString = byteData.hex()
+    charactersPerLine = 2 * bytesPerLine
+    if charactersPerLine <= 0 or len(hexString) <= charactersPerLine:
+        return '0x' + hexString
+    lines = [hexString[i:i+charactersPerLine] for i in range(0, len(hexString), charactersPerLine)]
+    return '0x' + lineSeparator + lineSeparator.join(lines)
 
 
 def indent(level):
@@ -49,9 +56,12 @@ def openCloseTag(name):
 def printXmlElement(out, level, name, value):
     out.write(indent(level) + openTag(name) + value + closeTag(name))
 
-def printObject(out, level, name, value):
+def printObject(out, level, name, value, hexBytesPerLine=0):
+    if m3.isNumpyArray(value):
+        # arrays of the numpyArrays loading mode get written like the lists they replace
+        value = value.tolist()
     valueType = type(value)
-    if value == None:
+    if value is None:
         out.write(indent(level) + openCloseTag(name))
         return
     
@@ -60,12 +70,14 @@ def printObject(out, level, name, value):
         printXmlElement(out, level, name, value)
         return
     
-    elif valueType == bytearray or valueType == bytes:
-        value = byteDataToHex(value)
+    elif valueType == bytearray or valueType == bytes or valueType == memoryview:
+        value = byteDataToHex(value, hexBytesPerLine, "\n" + indent(level + 1))
+        if "\n" in value:
+            value += "\n" + indent(level)
         printXmlElement(out, level, name, value)
         return
     
-    elif valueType == list:
+    elif isinstance(value, (list, m3.LazyReferenceList)):
         if len(value) == 0:
             out.write(indent(level) + openTag(name) + closeTag(name))
             return
@@ -77,17 +89,17 @@ def printObject(out, level, name, value):
         else:
             out.write(indent(level) + openTag(name) + "\n")
         for entry in value:
-            printObject(out, level + 1, name + "-element", entry)
+            printObject(out, level + 1, name + "-element", entry, hexBytesPerLine)
         
         out.write(indent(level) + closeTag(name))
         return
     
-    elif valueType == m3.M3Structure:
+    elif isinstance(value, m3.M3Structure):
         out.write(indent(level) + openTag(name) + "\n")
         
         for field in value.structureDescription.fields:
             v = getattr(value, field.name)
-            printObject(out, level + 1, field.name, v)
+            printObject(out, level + 1, field.name, v, hexBytesPerLine)
         
         out.write(indent(level) + closeTag(name))
         return
@@ -96,74 +108,114 @@ def printObject(out, level, name, value):
         printXmlElement(out, level, name, str(value))
         return
 
-def printModel(model, outputFilePath):
-    outputStream = io.StringIO()
+class ChunkedWriter:
+    """ Collects the many small strings of printObject and writes them in large chunks to a file """
     
-    outputFile = open(outputFilePath, "w")
-    modelDescription = model.structureDescription
-    outputStream.write('<model structureName="%s" structureVersion="%s" >\n' % (modelDescription.structureName, modelDescription.structureVersion))
-
-    for field in modelDescription.fields:
-        value = getattr(model, field.name)
-        printObject(outputStream, 0, field.name, value)
-
-    outputStream.write(closeTag("model"))
+    def __init__(self, outputFile, chunkSize=1024*1024):
+        self.outputFile = outputFile
+        self.chunkSize = chunkSize
+        self.parts = []
+        self.bufferedCharacters = 0
     
-    outputFile.write(outputStream.getvalue())
-    outputFile.close()
+    def write(self, string):
+        self.parts.append(string)
+        self.bufferedCharacters += len(string)
+        if self.bufferedCharacters >= self.chunkSize:
+            self.flush()
     
-    outputStream.close()
+    def flush(self):
+        self.outputFile.write("".join(self.parts))
+        self.parts = []
+        self.bufferedCharacters = 0
+
+def openOutputFile(outputFilePath):
+    if outputFilePath.endswith(".gz"):
+        return gzip.open(outputFilePath, "wt")
+    return open(outputFilePath, "w")
 
+def printModel(model, outputFilePath, hexBytesPerLine=0):
+    """ Writes the model as XML file; the file gets gzip compressed if its name ends with .gz
+
+    Byte data longer than hexBytesPerLine bytes gets split into multiple lines if it's not 0.
+    """
+    outputFile = openOutputFile(outputFilePath)
+    try:
+        outputStream = ChunkedWriter(outputFile)
+        modelDescription = model.structureDescription
+        outputStream.write('<model structureName="%s" structureVersion="%s" >\n' % (modelDescription.structureName, modelDescription.structureVersion))
 
-def convertFile(inputFilePath, outputFilePath, continueAtErrors):    
+        for field in modelDescription.fields:
+            value = getattr(model, field.name)
+            printObject(outputStream, 0, field.name, value, hexBytesPerLine)
+
+        outputStream.write(closeTag("model"))
+        outputStream.flush()
+    finally:
+        outputFile.close()
+
+
+def convertFile(inputFilePath, outputFilePath, continueAtErrors, hexBytesPerLine=0):
     model = None
     try:
         model = m3.loadModel(inputFilePath)
     except Exception as e:
         if continueAtErrors:
-            sys.stderr.write("\nError: %s\n" % e)
-            sys.stderr.write("\nFile: %s\n" % inputFilePath)
-            sys.stderr.write("Trace: %s\n" % traceback.format_exc())
+            # written at once so that the reports of parallel jobs don't interleave
+            sys.stderr.write("\nError: %s\n\nFile: %s\nTrace: %s\n" % (e, inputFilePath, traceback.format_exc()))
         else:
             raise e
         return False
     
-    printModel(model, outputFilePath)
+    printModel(model, outputFilePath, hexBytesPerLine)
     return True
 
-def processFile(inputPath, outputDirectory, inputFilePath, continueAtErrors):
+def processFile(inputPath, outputDirectory, inputFilePath, continueAtErrors, compress=False, hexBytesPerLine=0):
     relativeInputPath = os.path.relpath(inputFilePath, inputPath)
-    relativeOutputPath = relativeInputPath + ".xml"
+    outputExtension = ".xml.gz" if compress else ".xml"
+    relativeOutputPath = relativeInputPath + outputExtension
    
     if outputDirectory:
-        if outputDirectory and not os.path.exists(outputDirectory):
-            os.makedirs(outputDirectory)
         outputFilePath = os.path.join(outputDirectory, relativeOutputPath)
+        os.makedirs(os.path.dirname(outputFilePath), exist_ok=True)
     else:
-        outputFilePath = inputFilePath + ".xml"
+        outputFilePath = inputFilePath + outputExtension
     
     print("%s -> %s" % (inputFilePath, outputFilePath))
 
-    return convertFile(inputFilePath, outputFilePath, continueAtErrors)
+    return convertFile(inputFilePath, outputFilePath, continueAtErrors, hexBytesPerLine)
 
-def processDirectory(inputPath, outputPath, recurse, continueAtErrors):
-    
-    count, succeeded, failed = 0, 0, 0
-    
+def findModelFiles(inputPath, recurse):
     for path, dirs, files in os.walk(inputPath):
         
         for file in files:
             if file.endswith(".m3"):
-                
-                inputFilePath = os.path.join(path, file)
-                success = processFile(inputPath, outputPath, inputFilePath, continueAtErrors)
-                
-                succeeded += success
-                failed += not success
-                count += 1
+                yield os.path.join(path, file)
         
         if not recurse:
             break
+
+def processDirectory(inputPath, outputPath, recurse, continueAtErrors, compress=False, hexBytesPerLine=0, jobs=1):
+    """ Converts the m3 files of a directory; jobs > 1 converts that many files in parallel processes """
+    
+    count, succeeded, failed = 0, 0, 0
+    
+    inputFilePaths = findModelFiles(inputPath, recurse)
+    if jobs > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(processFile, inputPath, outputPath, inputFilePath, continueAtErrors, compress, hexBytesPerLine) for inputFilePath in inputFilePaths]
+            try:
+                results = [future.result() for future in concurrent.futures.as_completed(futures)]
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+    else:
+        results = (processFile(inputPath, outputPath, inputFilePath, continueAtErrors, compress, hexBytesPerLine) for inputFilePath in inputFilePaths)
+    
+    for success in results:
+        succeeded += success
+        failed += not success
+        count += 1
     
     return count, succeeded, failed
 
@@ -180,6 +232,15 @@ if __name__ == "__main__":
     parser.add_argument('-c', '--continue-at-errors',
         action='store_true', default=False,
         help='Continue if there are errors in the files')
+    parser.add_argument('-z', '--gzip',
+        action='store_true', default=False,
+        help='Write gzip compressed *.m3.xml.gz files')
+    parser.add_argument('--hex-bytes-per-line',
+        type=int, default=0,
+        help='Split hex encoded byte data into lines of the given number of bytes (0 = no splitting)')
+    parser.add_argument('-j', '--jobs',
+        type=int, default=1,
+        help='Number of files to convert in parallel (0 = one per CPU core)')
     args = parser.parse_args()
     
     outputDirectory = args.output_directory
@@ -195,6 +256,9 @@ if __name__ == "__main__":
     recurse = args.recurse
     
     continueAtErrors = args.continue_at_errors
+    compress = args.gzip
+    hexBytesPerLine = args.hex_bytes_per_line
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
     
     t0 = time.time()
     print("Converting files..")
@@ -203,10 +267,10 @@ if __name__ == "__main__":
         if os.path.isfile(path):
             inputFilePath = path
             path = os.path.dirname(path)
-            success = processFile(path, outputDirectory, inputFilePath, continueAtErrors)
+            success = processFile(path, outputDirectory, inputFilePath, continueAtErrors, compress, hexBytesPerLine)
             totalDelta, succeededDelta, failedDelta = 1, success, not success
         else:
-            totalDelta, succeededDelta, failedDelta = processDirectory(path, outputDirectory, recurse, continueAtErrors)
+            totalDelta, succeededDelta, failedDelta = processDirectory(path, outputDirectory, recurse, continueAtErrors, compress, hexBytesPerLine, jobs)
         total += totalDelta
         succeeded += succeededDelta
         failed += failedDelta
@@ -875,11 +875,10 @@ class Exporter:
             if bone.getNamedBit("flags","skinned"):
                 numberOfBonesToCheckForSkin = boneIndex + 1
         model.numberOfBonesToCheckForSkin = numberOfBonesToCheckForSkin        
+        model.vertices = m3VertexStructureDefinition.instancesToBytes(m3Vertices)
         #Add tangents to the vertices used for bump/normal mapping:
-        calculateTangents.recalculateTangentsOfDivisions(m3Vertices, model.divisions)
-
+        calculateTangents.recalculateTangentsOfModel(model)
 
-        model.vertices = m3VertexStructureDefinition.instancesToBytes(m3Vertices)
 
         startTime = time.time()
         self.initMeshBoundings(model, m3Vertices)
@@ -1564,17 +1563,6 @@ class Exporter:
                 
                 
                 # TODO export properties
-                # below are necessary animation property placeholder:
-                m3EndPoint.unknownffde53e1 = self.createNullFloatAnimationReference(initValue=1.0, nullValue=0.0)
-                m3EndPoint.unknowneae076ef = self.createNullFloatAnimationReference(initValue=1.0, nullValue=0.0)
-                m3EndPoint.unknownb40b972e = self.createNullFloatAnimationReference(initValue=0.0, nullValue=0.0)
-                m3EndPoint.unknown3af8b42c = self.createNullFloatAnimationReference(initValue=0.0, nullValue=0.0)
-                m3EndPoint.unknownceca9ac0 = self.createNullFloatAnimationReference(initValue=0.0, nullValue=0.0)
-                m3EndPoint.unknownf155acc8 = self.createNullFloatAnimationReference(initValue=0.0, nullValue=0.0)
-                m3EndPoint.unknown211e7ec5 = self.createNullAnimHeader(interpolationType=1)
-                m3EndPoint.unknownf2bce2c7 = self.createNullAnimHeader(interpolationType=1)
-                m3EndPoint.unknown534e55c8 = self.createNullAnimHeader(interpolationType=1)
-                m3EndPoint.unknown974d3fd5 = self.createNullAnimHeader(interpolationType=1)
                 m3Ribbon.endPoints.append(m3EndPoint)
     
     def initProjections(self, model):
@@ -1875,13 +1863,10 @@ class Exporter:
         isVideo = shared.isVideoFilePath(layer.imagePath)
         m3Layer.setNamedBit("flags", "isVideo", isVideo)
         if not isVideo:
-            m3Layer.vidoeFrameRate= 0
+            m3Layer.videoFrameRate = 0
             m3Layer.videoStartFrame = 0
             m3Layer.videoEndFrame = 0
             m3Layer.videoMode = 0
-        m3Layer.unknownbc0c14e5 = self.createNullUInt32AnimationReference(0)
-        m3Layer.unknowne740df12 = self.createNullFloatAnimationReference(0.0, interpolationType=1)
-        m3Layer.unknown39ade219 = self.createNullUInt16AnimationReference(0)
         m3Layer.unknowna4ec0796 = self.createNullUInt32AnimationReference(0, interpolationType=1)
         m3Layer.unknowna44bf452 = self.createNullFloatAnimationReference(1.0, interpolationType=1)
         return m3Layer
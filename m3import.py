@@ -47,8 +47,9 @@ def toBlenderVector2(m3Vector2):
 def toBlenderColorVector(m3Color):
     return mathutils.Vector((m3Color.red /255.0, m3Color.green /255.0, m3Color.blue /255.0, m3Color.alpha /255.0))
 
-def toBlenderUVCoordinate(m3UVCoordinate):
-    return (m3UVCoordinate.x / 2048.0, 1 - m3UVCoordinate.y / 2048.0)
+def toBlenderUVCoordinates(m3UVCoordinates):
+    """ Converts the uv fields of a vertex array to a list of blender uv coordinates """
+    return list(zip((m3UVCoordinates.x / 2048.0).tolist(), (1 - m3UVCoordinates.y / 2048.0).tolist()))
 
 def toBlenderMatrix(m3Matrix):
     return mathutils.Matrix((
@@ -1256,34 +1257,26 @@ class Importer:
         if model.vFlags == 0x180007d:
             return # no vertices
 
-        vertexClassName = "VertexFormat" + hex(self.model.vFlags)        
-        if not vertexClassName in m3.structures:
-            raise Exception("Vertex flags %s can't behandled yet" % hex(self.model.vFlags))
-        vertexStructureDescription = m3.structures[vertexClassName].getVersion(0)
-
-        numberOfVertices = len(self.model.vertices) // vertexStructureDescription.size
-        m3Vertices = vertexStructureDescription.createInstances(buffer=self.model.vertices, count=numberOfVertices)
+        vertexStructureDescription = m3.vertexStructureDescriptionOf(model)
+        vertices = m3.vertexArray(model)
+        # Columns get converted to lists at once, since single numpy values are slow to access:
+        xyz = ("x", "y", "z")
+        positionColumns = [vertices.position[name].tolist() for name in xyz]
+        normalColumns = [m3.fixed8ToFloat(vertices.normal[name]).tolist() for name in xyz]
+        boneWeightColumns = [vertices["boneWeight%d" % i].tolist() for i in range(4)]
+        boneLookupIndexColumns = [vertices["boneLookupIndex%d" % i].tolist() for i in range(4)]
+        vertexPositionsOfM3 = list(zip(*positionColumns))
+        vertexIdTuples = list(zip(*(positionColumns + boneWeightColumns + boneLookupIndexColumns + normalColumns)))
+        boneWeightsOfM3 = list(zip(*boneWeightColumns))
+        boneLookupIndicesOfM3 = list(zip(*boneLookupIndexColumns))
+        uvCoordinatesOfAttribute = dict((name, toBlenderUVCoordinates(vertices[name])) for name in ["uv0", "uv1", "uv2", "uv3"] if vertexStructureDescription.hasField(name))
 
         for division in self.model.divisions:
-            divisionFaceIndices = division.faces
+            regionFaceArrays = m3.regionFaceArrays(division)
             for m3Object in division.objects:
                 region = division.regions[m3Object.regionIndex]
                 regionVertexIndices = range(region.firstVertexIndex,region.firstVertexIndex + region.numberOfVertices)
-                firstVertexIndexIndex = region.firstFaceVertexIndexIndex
-                lastVertexIndexIndex = firstVertexIndexIndex + region.numberOfFaceVertexIndices
-                vertexIndexIndex = firstVertexIndexIndex
-                firstVertexIndex = region.firstVertexIndex
-                assert region.numberOfFaceVertexIndices % 3 == 0
-
-                facesWithOldIndices = [] # old index = index of vertex in m3Vertices
-                while vertexIndexIndex + 2 <= lastVertexIndexIndex:
-                    i0 = firstVertexIndex + divisionFaceIndices[vertexIndexIndex]
-                    i1 = firstVertexIndex + divisionFaceIndices[vertexIndexIndex + 1]
-                    i2 = firstVertexIndex + divisionFaceIndices[vertexIndexIndex + 2]
-                    face = (i0, i1, i2)
-                    facesWithOldIndices.append(face)
-                    vertexIndexIndex += 3
-
+                facesWithOldIndices = regionFaceArrays[m3Object.regionIndex].tolist() # old index = index of vertex in vertices
 
                 boneIndexLookup = model.boneLookup[region.firstBoneLookupIndex:region.firstBoneLookupIndex + region.numberOfBoneLookupIndices]
                 numberOfBones = len(boneIndexLookup)
@@ -1306,10 +1299,7 @@ class Importer:
                 # old (stored) vertex -> tuple of vertex data that makes the vertex unique
                 oldVertexIndexToTupleIdMap = {}
                 for vertexIndex in regionVertexIndices:
-                    m3Vertex = m3Vertices[vertexIndex]
-                    v = m3Vertex
-                    idTuple = (v.position.x, v.position.y, v.position.z, v.boneWeight0, v.boneWeight1, v.boneWeight2, v.boneWeight3, v.boneLookupIndex0, v.boneLookupIndex1, v.boneLookupIndex2, v.boneLookupIndex3, v.normal.x, v.normal.y, v.normal.z)
-                    oldVertexIndexToTupleIdMap[vertexIndex] = idTuple
+                    oldVertexIndexToTupleIdMap[vertexIndex] = vertexIdTuples[vertexIndex]
                 
                 nonTrianglesCounter = 0
                 tranglesWithOldIndices = []
@@ -1336,9 +1326,7 @@ class Importer:
                     if newIndex == None:
                         newIndex = nextNewVertexIndex
                         nextNewVertexIndex += 1
-                        m3Vertex = m3Vertices[vertexIndex]
-                        position = (m3Vertex.position.x, m3Vertex.position.y, m3Vertex.position.z)
-                        vertexPositions.append(position)
+                        vertexPositions.append(vertexPositionsOfM3[vertexIndex])
                         vertexIdTupleToNewIndexMap[idTuple] = newIndex
                     oldVertexIndexToNewVertexIndexMap[vertexIndex] = newIndex
                     #store which old vertex indices where merged to a new one:
@@ -1383,16 +1371,17 @@ class Importer:
                     if len(matchingOldVertexIndices) != 1:
                         raise Exception("There was a problem with calculating which UV belongs to which vertex: matching vertices %s; newToOldIndices: %s, triangle: %s" % (len(matchingOldVertexIndices), oldVertexIndices, setOfOldVertexIndicesOfFace))
                     oldVertexIndex = matchingOldVertexIndices.pop()
-                    return toBlenderUVCoordinate(getattr(m3Vertices[oldVertexIndex],vertexUVAttribute))
+                    return uvCoordinatesOfAttribute[vertexUVAttribute][oldVertexIndex]
                 
                 for vertexUVAttribute in ["uv0", "uv1", "uv2", "uv3"]:
                     if vertexStructureDescription.hasField(vertexUVAttribute):
+                        uvCoordinates = uvCoordinatesOfAttribute[vertexUVAttribute]
                         uvTexture = mesh.uv_textures.new()
                         uvLayer = mesh.uv_layers[len(mesh.uv_layers)-1]
                         for faceIndex, polygon in enumerate(mesh.polygons):
                             oldIndices = tranglesWithOldIndices[faceIndex]
                             for i in range(3):
-                                uvLayer.data[polygon.loop_start + i].uv = toBlenderUVCoordinate(getattr(m3Vertices[oldIndices[i]],vertexUVAttribute))
+                                uvLayer.data[polygon.loop_start + i].uv = uvCoordinates[oldIndices[i]]
                             
                             
                         if False:# old:
@@ -1423,9 +1412,8 @@ class Importer:
                             vertexGroup =  meshObject.vertex_groups.new(boneName)
                         vertexGroupLookup.append(vertexGroup)
                     for vertexIndex in range(region.firstVertexIndex,region.firstVertexIndex + region.numberOfVertices):
-                        m3Vertex = m3Vertices[vertexIndex]
-                        boneWeightsAsInt = [m3Vertex.boneWeight0, m3Vertex.boneWeight1, m3Vertex.boneWeight2, m3Vertex.boneWeight3]
-                        boneLookupIndices = [m3Vertex.boneLookupIndex0, m3Vertex.boneLookupIndex1,  m3Vertex.boneLookupIndex2,  m3Vertex.boneLookupIndex3]
+                        boneWeightsAsInt = boneWeightsOfM3[vertexIndex]
+                        boneLookupIndices = boneLookupIndicesOfM3[vertexIndex]
                         boneWeights = []
                         for boneWeightAsInt, boneLookupIndex in zip(boneWeightsAsInt, boneLookupIndices):
                             if boneWeightAsInt != 0:
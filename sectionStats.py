@@ -0,0 +1,143 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+import m3
+import argparse
+import csv
+import json
+import os
+import sys
+
+statisticNames = ["files", "sections", "repetitions", "bytes", "paddingBytes", "decodeSeconds"]
+
+def sectionStatisticsOf(filePath):
+    """ Returns a map from (tag, version) to the statistics of the sections with that structure """
+    profile = m3.PhaseProfile()
+    sections = m3.loadSections(filePath, checkExpectedValue=False, instrumentation=profile)
+    statisticsMap = {}
+    for section in sections:
+        indexEntry = section.indexEntry
+        key = (indexEntry.tag, indexEntry.version)
+        statistics = statisticsMap.get(key)
+        if statistics == None:
+            statistics = dict((name, 0) for name in statisticNames)
+            statistics["files"] = 1
+            statistics["decodeSeconds"] = profile.sectionStatistics["%sV%d" % key]["seconds"]
+            statisticsMap[key] = statistics
+        statistics["sections"] += 1
+        statistics["repetitions"] += indexEntry.repetitions
+        statistics["bytes"] += len(section.rawBytes)
+        statistics["paddingBytes"] += len(section.rawBytes) - section.structureDescription.size * indexEntry.repetitions
+    return statisticsMap
+
+def addStatistics(totalStatisticsMap, statisticsMap):
+    for key, statistics in statisticsMap.items():
+        totalStatistics = totalStatisticsMap.get(key)
+        if totalStatistics == None:
+            totalStatisticsMap[key] = dict(statistics)
+        else:
+            for name in statisticNames:
+                totalStatistics[name] += statistics[name]
+
+def findModelFiles(paths, recurse):
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for directory, subdirectories, fileNames in os.walk(path):
+            for fileName in sorted(fileNames):
+                if fileName.endswith(".m3") or fileName.endswith(".m3a"):
+                    yield os.path.join(directory, fileName)
+            if not recurse:
+                break
+
+def statisticsRows(statisticsMap):
+    """ Returns the statistics as list of maps, sorted by the number of bytes """
+    rows = []
+    for (tag, version), statistics in statisticsMap.items():
+        row = {"tag": tag, "version": version}
+        row.update(statistics)
+        rows.append(row)
+    rows.sort(key=lambda row: row["bytes"], reverse=True)
+    return rows
+
+def printStatistics(title, statisticsMap):
+    rows = statisticsRows(statisticsMap)
+    totalBytes = max(1, sum(row["bytes"] for row in rows))
+    totalSeconds = max(1e-9, sum(row["decodeSeconds"] for row in rows))
+    print(title)
+    print("%-6s %3s %7s %9s %11s %12s %6s %10s %9s %6s" % ("tag", "ver", "files", "sections", "repetitions", "bytes", "bytes%", "padding", "decode s", "time%"))
+    for row in rows:
+        print("%-6s %3d %7d %9d %11d %12d %5.1f%% %10d %9.3f %5.1f%%" % (row["tag"], row["version"], row["files"], row["sections"], row["repetitions"], row["bytes"], 100.0 * row["bytes"] / totalBytes, row["paddingBytes"], row["decodeSeconds"], 100.0 * row["decodeSeconds"] / totalSeconds))
+    print()
+
+def writeCsv(csvPath, statisticsMapOfFiles, totalStatisticsMap):
+    with open(csvPath, "w", newline="") as csvFile:
+        writer = csv.DictWriter(csvFile, fieldnames=["file", "tag", "version"] + statisticNames)
+        writer.writeheader()
+        for filePath, statisticsMap in statisticsMapOfFiles.items():
+            for row in statisticsRows(statisticsMap):
+                row["file"] = filePath
+                writer.writerow(row)
+        for row in statisticsRows(totalStatisticsMap):
+            row["file"] = "*"
+            writer.writerow(row)
+
+def writeJson(jsonPath, statisticsMapOfFiles, totalStatisticsMap, failedFiles):
+    content = {
+        "files": dict((filePath, statisticsRows(statisticsMap)) for filePath, statisticsMap in statisticsMapOfFiles.items()),
+        "total": statisticsRows(totalStatisticsMap),
+        "failedFiles": failedFiles
+    }
+    with open(jsonPath, "w") as jsonFile:
+        json.dump(content, jsonFile, indent=1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reports the repetitions, bytes, padding bytes and decode time of the sections per structure tag and version.")
+    parser.add_argument('path', nargs='+', help="m3 or m3a files or directories containing them")
+    parser.add_argument('-r', '--recurse', action='store_true', default=False, help="Search the directories recursively")
+    parser.add_argument('--per-file', action='store_true', default=False, help="Print the statistics of each file too")
+    parser.add_argument('--csv', help="Write the statistics of each file and the total into this CSV file")
+    parser.add_argument('--json', help="Write the statistics of each file and the total into this JSON file")
+    args = parser.parse_args()
+
+    statisticsMapOfFiles = {}
+    totalStatisticsMap = {}
+    failedFiles = {}
+    for filePath in findModelFiles(args.path, args.recurse):
+        try:
+            statisticsMap = sectionStatisticsOf(filePath)
+        except Exception as e:
+            sys.stderr.write("Failed to load %s: %s\n" % (filePath, e))
+            failedFiles[filePath] = str(e)
+            continue
+        statisticsMapOfFiles[filePath] = statisticsMap
+        addStatistics(totalStatisticsMap, statisticsMap)
+        if args.per_file:
+            printStatistics(filePath, statisticsMap)
+
+    printStatistics("Total of %d files:" % len(statisticsMapOfFiles), totalStatisticsMap)
+    if args.csv != None:
+        writeCsv(args.csv, statisticsMapOfFiles, totalStatisticsMap)
+    if args.json != None:
+        writeJson(args.json, statisticsMapOfFiles, totalStatisticsMap, failedFiles)
+    if len(failedFiles) > 0:
+        sys.exit(1)
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import types
+import importlib
+
+import m3
+
+addonDirectory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+addonPackageName = "m3addon"
+
+def importAddonModule(moduleName):
+    """ Imports a module which uses relative imports like "from . import m3" as part of the addon package.
+
+    The __init__.py of the addon requires blender, so the package gets created without executing it.
+    """
+    if addonPackageName not in sys.modules:
+        package = types.ModuleType(addonPackageName)
+        package.__path__ = [addonDirectory]
+        sys.modules[addonPackageName] = package
+        # Share the already imported m3 module, so that the structures get read only once:
+        sys.modules[addonPackageName + ".m3"] = m3
+    return importlib.import_module(addonPackageName + "." + moduleName)
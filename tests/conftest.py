@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import m3
+import benchmark
+
+@pytest.fixture
+def modelPath(tmp_path):
+    """ A small synthetic m3 file with a mesh, bones and animations """
+    path = str(tmp_path / "model.m3")
+    model = benchmark.createSyntheticModel(numberOfVertices=30, numberOfBones=5, numberOfSequences=2, numberOfKeys=4)
+    m3.saveAndInvalidateModel(model, path)
+    return path
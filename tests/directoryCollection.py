@@ -0,0 +1,9 @@
+import os
+import pytest
+
+addonDirectory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def pytest_collect_directory(path, parent):
+    # The addon package can only be imported within Blender, so its directory gets collected as plain directory
+    if str(path) == addonDirectory:
+        return pytest.Dir.from_parent(parent, path=path)
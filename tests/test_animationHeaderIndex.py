@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import m3
+
+def headerAnimIds(index):
+    return dict((key, header.animId) for key, header in index.keyToHeaderMap.items())
+
+def testKeysContainTheStructureAndTheFieldPath(modelPath):
+    index = m3.AnimationHeaderIndex(m3.loadModel(modelPath))
+    assert index.keyToHeaderMap["bones[BONE:Bone0].location.header"].animId == 0x1000
+    assert index.keyToHeaderMap["bones[BONE:Bone4].scale.header"].animId == 0x3004
+
+def testRemappingRestoresTheAnimIdsOfTheOtherModel(modelPath):
+    animIdIndex = m3.AnimationHeaderIndex(m3.loadModel(modelPath))
+    modelToFix = m3.loadModel(modelPath)
+    indexToFix = m3.AnimationHeaderIndex(modelToFix)
+    indexToFix.remapAnimIds(dict((animId, animId + 0x100) for animId in headerAnimIds(indexToFix).values()))
+    assert modelToFix.bones[0].location.header.animId == 0x1100
+    assert modelToFix.sts[0].animIds[0] == 0x1100
+
+    conflicts = []
+    animIdMap = indexToFix.animIdMapTo(animIdIndex, conflicts)
+    indexToFix.remapAnimIds(animIdMap)
+    assert conflicts == []
+    assert headerAnimIds(indexToFix) == headerAnimIds(animIdIndex)
+    originalModel = animIdIndex.model
+    assert [stc.animIds for stc in modelToFix.sequenceTransformationCollections] == [stc.animIds for stc in originalModel.sequenceTransformationCollections]
+    assert [sts.animIds for sts in modelToFix.sts] == [sts.animIds for sts in originalModel.sts]
+
+def testConflictsKeepTheFirstMapping(modelPath):
+    animIdIndex = m3.AnimationHeaderIndex(m3.loadModel(modelPath))
+    modelToFix = m3.loadModel(modelPath)
+    modelToFix.bones[0].location.header.animId = 0x7777
+    modelToFix.bones[1].location.header.animId = 0x7777
+    indexToFix = m3.AnimationHeaderIndex(modelToFix)
+    conflicts = []
+    animIdMap = indexToFix.animIdMapTo(animIdIndex, conflicts)
+    assert animIdMap[0x7777] == 0x1000
+    assert conflicts == [("bones[BONE:Bone1].location.header", 0x7777, 0x1000, 0x1001)]
+    assert indexToFix.animIdMapTo(animIdIndex)[0x7777] == 0x1000
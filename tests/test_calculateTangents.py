@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import m3
+from addonModules import importAddonModule
+
+calculateTangents = importAddonModule("calculateTangents")
+
+# Computed by the per face implementation which the numpy one replaced:
+expectedTangentsAndSigns = [
+    (60, 23, 101, 0), (28, 65, 178, 0), (22, 69, 168, 255), (109, 242, 181, 0), (29, 51, 99, 255),
+    (61, 57, 211, 255), (42, 221, 140, 0), (99, 100, 6, 255), (87, 7, 117, 255), (83, 50, 218, 255),
+    (228, 158, 55, 255), (62, 237, 131, 0), (48, 28, 138, 0), (41, 136, 221, 255), (84, 17, 174, 255),
+    (170, 212, 42, 0), (84, 130, 8, 255), (2, 110, 137, 0), (128, 204, 229, 0), (73, 212, 50, 255),
+    (50, 93, 32, 255), (94, 160, 246, 0), (80, 173, 19, 255), (153, 119, 252, 255), (128, 128, 128, 128),
+    (73, 234, 84, 0), (37, 38, 142, 255), (34, 101, 45, 0), (31, 207, 153, 0), (238, 73, 95, 0)]
+
+def tangentsAndSignsOf(vertices):
+    return [(int(v.tangent.x), int(v.tangent.y), int(v.tangent.z), int(v.sign)) for v in vertices]
+
+def testTangentsOfSyntheticModel(modelPath):
+    model = m3.loadModel(modelPath)
+    calculateTangents.recalculateTangentsOfModel(model)
+    assert tangentsAndSignsOf(m3.vertexArray(model)) == expectedTangentsAndSigns
+
+def setVertex(vertex, x, y, u, v):
+    vertex.position.x, vertex.position.y, vertex.position.z = x, y, 0.0
+    vertex.uv0.x = round(u * 2048)
+    vertex.uv0.y = round((1 - v) * 2048)
+
+def testFacesWithDegeneratedUVsGetIgnored(modelPath):
+    model = m3.loadModel(modelPath)
+    vertices = m3.vertexArray(model)
+    # A quad in the xy plane whose uv coordinates equal its positions, so the tangent is the x axis:
+    for vertexIndex, (x, y) in enumerate([(0, 0), (1, 0), (0, 1), (1, 1)]):
+        setVertex(vertices[vertexIndex], x, y, x, y)
+    # Vertex 4 has the uv coordinates of vertex 0, so the face (0, 1, 4) has no uv area:
+    setVertex(vertices[4], 0.5, -1, 0, 0)
+    vertices.tangent.x[4] = 17
+    unchangedTangentsAndSigns = tangentsAndSignsOf(vertices[4:])
+
+    calculateTangents.recalculateTangentsOfVertexArray(vertices, [(0, 1, 2), (1, 3, 2), (0, 1, 4)])
+    # The x axis as fixed8 values; the normals point to +z, so the sign is -1:
+    assert tangentsAndSignsOf(vertices[:4]) == [(255, 128, 128, 0)] * 4
+    assert tangentsAndSignsOf(vertices[4:]) == unchangedTangentsAndSigns
+
+def testCalculateTangentsReportsUsedVertices():
+    positions = [(0, 0, 0), (1, 0, 0), (0, 1, 0), (5, 5, 5), (1, 1, 0)]
+    uvs = [(0, 0), (1, 0), (0, 1), (0, 0), (1, 0)]
+    normals = [(0, 0, 1)] * 5
+    tangents, signs, usedVertices = calculateTangents.calculateTangents(positions, uvs, normals, [(0, 1, 2), (0, 1, 4)])
+    assert usedVertices.tolist() == [True, True, True, False, False]
+    assert tangents[:3].tolist() == [[1.0, 0.0, 0.0]] * 3
+    assert signs[:3].tolist() == [-1.0] * 3
+
+def readBytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def writeBytes(path, content):
+    with open(path, "wb") as f:
+        f.write(content)
+
+def testUnchangedFilesDoNotGetWritten(modelPath, tmp_path):
+    convertedPath = str(tmp_path / "converted.m3")
+    calculateTangents.convert(modelPath, convertedPath)
+    outputPath = str(tmp_path / "output" / "unchanged.m3")
+    assert calculateTangents.convertIfChanged(convertedPath, outputPath) == 0.0
+    assert not (tmp_path / "output").exists()
+    # Changes up to the tolerance count as unchanged too:
+    change = calculateTangents.convertIfChanged(modelPath, outputPath, tolerance=2.0)
+    assert 0.0 < change <= 2.0
+    assert not (tmp_path / "output").exists()
+
+def testChangedFilesGetReplaced(modelPath, tmp_path):
+    convertedPath = str(tmp_path / "converted.m3")
+    calculateTangents.convert(modelPath, convertedPath)
+    assert calculateTangents.convertIfChanged(modelPath, modelPath) > 0.0
+    assert readBytes(modelPath) == readBytes(convertedPath)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["converted.m3", "model.m3"]
+
+def testFailedWritesKeepTheOriginalFile(modelPath, tmp_path, monkeypatch):
+    originalBytes = readBytes(modelPath)
+    def failingSave(model, filename, validate="full", instrumentation=None):
+        writeBytes(filename, b"partial")
+        raise Exception("disk full")
+    monkeypatch.setattr(m3, "saveAndInvalidateModel", failingSave)
+    try:
+        calculateTangents.convertIfChanged(modelPath, modelPath)
+    except Exception as e:
+        assert str(e) == "disk full"
+    else:
+        assert False, "The exception of the save should be passed on"
+    assert readBytes(modelPath) == originalBytes
+    assert [path.name for path in tmp_path.iterdir()] == ["model.m3"]
+
+def testOutputDirectoryMirrorsTheInputDirectories(modelPath, tmp_path):
+    inputDirectory = tmp_path / "input"
+    (inputDirectory / "changed").mkdir(parents=True)
+    (inputDirectory / "unchanged").mkdir()
+    writeBytes(str(inputDirectory / "changed" / "a.m3"), readBytes(modelPath))
+    calculateTangents.convert(modelPath, str(inputDirectory / "unchanged" / "b.m3"))
+    outputDirectory = tmp_path / "output"
+
+    result = calculateTangents.processFiles([str(inputDirectory)], str(outputDirectory), recurse=True)
+    assert result == (1, 1, 0)
+    assert sorted(str(path.relative_to(outputDirectory)) for path in outputDirectory.rglob("*")) == ["changed", "changed/a.m3"]
+    assert readBytes(str(outputDirectory / "changed" / "a.m3")) == readBytes(str(inputDirectory / "unchanged" / "b.m3"))
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import fileWatcher
+
+def writeFile(path, content):
+    with open(path, "w") as f:
+        f.write(content)
+
+def testPollingReportsChangedFiles(tmp_path):
+    watchedPath = str(tmp_path / "a.m3")
+    ignoredPath = str(tmp_path / "b.txt")
+    writeFile(watchedPath, "1")
+    writeFile(ignoredPath, "1")
+    watcher = fileWatcher.FileWatcher([str(tmp_path)], lambda fileName: fileName.endswith(".m3"), debounceDelay=0.05, pollInterval=0.05, usePolling=True)
+    try:
+        assert not watcher.usesInotify()
+        # Ensure a different modification time even on file systems with a coarse resolution:
+        os.utime(watchedPath, ns=(0, 0))
+        writeFile(ignoredPath, "2")
+        assert watcher.waitForChanges() == {os.path.normpath(watchedPath)}
+    finally:
+        watcher.close()
+
+def testPollingGetsUsedWithoutInotify(tmp_path, monkeypatch):
+    monkeypatch.setattr(sys, "platform", "win32")
+    assert fileWatcher.loadInotifyFunctions() == None
+    watcher = fileWatcher.FileWatcher([str(tmp_path)], lambda fileName: True)
+    assert not watcher.usesInotify()
+    watcher.close()
+
+def testWatcherClosesAsContextManager(tmp_path):
+    with fileWatcher.FileWatcher([str(tmp_path)], lambda fileName: True) as watcher:
+        pass
+    assert not watcher.usesInotify()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import m3
+
+def readBytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def testByteArraysAreViewsOfTheMappedFile(modelPath):
+    model, mappedFile = m3.openLazyModel(modelPath, numpyArrays=True)
+    with mappedFile:
+        assert type(model.vertices) == memoryview
+        assert not model.divisions[0].faces.flags.writeable
+    assert type(model.vertices) == bytearray
+    assert model.divisions[0].faces.flags.writeable
+
+def testModelCanBeSavedOverItsFileAfterClose(modelPath):
+    originalBytes = readBytes(modelPath)
+    model, mappedFile = m3.openLazyModel(modelPath)
+    mappedFile.close()
+    m3.saveAndInvalidateModel(model, modelPath)
+    assert readBytes(modelPath) == originalBytes
+
+def testSectionsDecodedAfterCloseUseCopiedBytes(modelPath):
+    eagerModel = m3.loadModel(modelPath)
+    model, mappedFile = m3.openLazyModel(modelPath)
+    bones = model.bones
+    mappedFile.close()
+    assert [bone.name for bone in bones] == [bone.name for bone in eagerModel.bones]
+
+def testLazyListsBehaveLikeLists(modelPath):
+    eagerBoneNames = [bone.name for bone in m3.loadModel(modelPath).bones]
+    model = m3.loadModel(modelPath, lazy=True)
+    bones = model.bones
+    assert isinstance(bones, m3.LazyReferenceList)
+    assert len([] + bones) == len(eagerBoneNames)
+    assert len(bones + []) == len(eagerBoneNames)
+    extendedList = []
+    extendedList.extend(m3.loadModel(modelPath, lazy=True).bones)
+    assert [bone.name for bone in extendedList] == eagerBoneNames
+    assert [bone.name for bone in tuple(m3.loadModel(modelPath, lazy=True).bones)] == eagerBoneNames
+    assert ",".join(bone.name for bone in m3.loadModel(modelPath, lazy=True).bones) == ",".join(eagerBoneNames)
+
+def testFieldsGetTheDecodedListOnFirstAccess(modelPath):
+    model = m3.loadModel(modelPath, lazy=True)
+    bones = model.bones
+    assert bones[0].name == "Bone0"
+    assert type(model.bones) == list
+    assert model.bones is bones.load()
+    bones.append(bones[0])
+    assert len(model.bones) == 6
+
+def testLazyModelRoundTrip(modelPath, tmp_path):
+    model = m3.loadModel(modelPath, lazy=True)
+    outputPath = str(tmp_path / "saved.m3")
+    m3.saveAndInvalidateModel(model, outputPath)
+    assert readBytes(outputPath) == readBytes(modelPath)
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+
+import io
+
+import m3
+import m3ToXml
+
+def xmlOf(model):
+    out = io.StringIO()
+    m3ToXml.printObject(out, 0, "model", model)
+    return out.getvalue()
+
+def testNumpyArraysGetWrittenLikeLists(modelPath):
+    modelWithLists = m3.loadModel(modelPath)
+    modelWithArrays = m3.loadModel(modelPath, numpyArrays=True)
+    assert m3.isNumpyArray(modelWithArrays.divisions[0].faces)
+    assert xmlOf(modelWithArrays) == xmlOf(modelWithLists)
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import pytest
+import m3
+
+def testPathsSelectTheSameValuesAsTheLoadedModel(modelPath):
+    model = m3.loadModel(modelPath)
+    with m3.MetadataReader(modelPath) as reader:
+        assert reader.read("model.sequences[*].name") == [sequence.name for sequence in model.sequences]
+        assert reader.read("model.bones[1].name") == model.bones[1].name
+        assert reader.read("model.bones[*].parent") == [bone.parent for bone in model.bones]
+        assert reader.read("model.uniqueUnknownNumber") == model.uniqueUnknownNumber
+
+def testOnlyTheNeededSectionsGetDecoded(modelPath):
+    with m3.MetadataReader(modelPath) as reader:
+        reader.read("model.sequences[*].name")
+        decodedTags = sorted(reader.indexEntries[sectionIndex].tag for sectionIndex in reader.sectionContents)
+        numberOfSequences = reader.model().sequences.entries
+    assert decodedTags == sorted(["MODL", "SEQS"] + ["CHAR"] * numberOfSequences)
+
+def testEmptyReferencesGetEmptyLists(modelPath):
+    with m3.MetadataReader(modelPath) as reader:
+        assert reader.read("model.lights[*].type") == []
+
+def testInvalidPathsGetReported(modelPath):
+    with m3.MetadataReader(modelPath) as reader:
+        with pytest.raises(Exception, match="does not start with model"):
+            reader.read("sequences[*].name")
+        with pytest.raises(Exception, match="has no field"):
+            reader.read("model.noSuchField")
+        with pytest.raises(Exception, match="Invalid path segment"):
+            reader.read("model.sequences[x]")
+
+def testReadModelPaths(modelPath):
+    model = m3.loadModel(modelPath)
+    paths = ["model.sequences[0].name", "model.bones[*].name"]
+    assert m3.readModelPaths(modelPath, paths) == {
+        "model.sequences[0].name": model.sequences[0].name,
+        "model.bones[*].name": [bone.name for bone in model.bones]}
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+
+import numpy
+
+import m3
+
+def readBytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def testSaveOfCallerBuiltArray(modelPath, tmp_path, monkeypatch):
+    # m3 imports numpy only on demand; the array got created without it
+    monkeypatch.setattr(m3, "numpy", None)
+    model = m3.loadModel(modelPath)
+    model.divisions[0].faces = numpy.array(model.divisions[0].faces, dtype=numpy.uint16)
+    outputPath = str(tmp_path / "saved.m3")
+    m3.saveAndInvalidateModel(model, outputPath)
+    assert readBytes(outputPath) == readBytes(modelPath)
+
+def testRoundTripWithNumpyArrays(modelPath, tmp_path):
+    model = m3.loadModel(modelPath, numpyArrays=True)
+    assert m3.isNumpyArray(model.divisions[0].faces)
+    outputPath = str(tmp_path / "saved.m3")
+    m3.saveAndInvalidateModel(model, outputPath)
+    assert readBytes(outputPath) == readBytes(modelPath)
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import io
+import struct
+import pytest
+import m3
+
+def loadResolvedSections(modelPath):
+    sections = m3.loadSections(modelPath)
+    m3.resolveReferencesOfSections(sections)
+    return sections
+
+def sectionIndexOfTag(sections, tag):
+    return next(i for i, section in enumerate(sections) if section.indexEntry.tag == tag)
+
+def testReferenceFieldPathsIncludeEmbeddedStructures():
+    referenceFieldPaths = m3.structures["BONE"].getNewestVersion().getReferenceFieldPaths()
+    assert "name" in referenceFieldPaths.values()
+    modelReferenceFieldPaths = m3.structures["MODL"].getVersion(23).getReferenceFieldPaths()
+    assert "bones" in modelReferenceFieldPaths.values()
+    assert len(set(modelReferenceFieldPaths.values())) == len(modelReferenceFieldPaths)
+
+def testOnlyMatchesAtReferenceFieldsAreCandidates(modelPath):
+    sections = loadResolvedSections(modelPath)
+    boneSectionIndex = sectionIndexOfTag(sections, "BONE")
+    boneSection = sections[boneSectionIndex]
+    # Place the entries and index of the bone reference at an offset of a bone which is no reference:
+    entriesAndIndex = struct.pack("<II", boneSection.indexEntry.repetitions, boneSectionIndex)
+    rawBytes = bytearray(boneSection.rawBytes)
+    rawBytes[1:9] = entriesAndIndex
+    boneSection.rawBytes = bytes(rawBytes)
+    candidates = m3.findReferenceCandidates(sections, [boneSectionIndex])
+    bonesOffset = next(offset for offset, fieldPath in m3.structures["MODL"].getVersion(23).getReferenceFieldPaths().items() if fieldPath == "bones")
+    assert [(section.indexEntry.tag, offset, fieldPath, flags) for section, offset, fieldPath, flags in candidates[boneSectionIndex]] == [("MODL", bonesOffset, "bones", 0)]
+
+def testUnreferencedSectionsGetReportedOnce(modelPath, monkeypatch):
+    sections = loadResolvedSections(modelPath)
+    boneSectionIndex = sectionIndexOfTag(sections, "BONE")
+    sections[boneSectionIndex].timesReferenced = 0
+    log = io.StringIO()
+    monkeypatch.setattr(m3, "stderr", log)
+    with pytest.raises(Exception, match="1 unreferenced sections"):
+        m3.checkThatAllSectionsGotReferenced(sections)
+    lines = log.getvalue().splitlines()
+    assert lines[0].startswith("WARNING: BONEV")
+    assert lines[1:] == ["  -> Found a reference in the field bones of the element 0 of a section of type MODLV23 with flags 0x00000000"]
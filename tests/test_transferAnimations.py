@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import pytest
+import m3
+import benchmark
+import transferAnimations
+
+def readBytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def saveAnimationFile(path, namePrefix, numberOfSequences, seed):
+    model = benchmark.createSyntheticModel(numberOfVertices=30, numberOfBones=5, numberOfSequences=numberOfSequences, numberOfKeys=4, seed=seed)
+    for sequence in model.sequences:
+        sequence.name = namePrefix + sequence.name
+    m3.saveAndInvalidateModel(model, path)
+    return path
+
+@pytest.fixture
+def animationFiles(tmp_path):
+    m3FilePath = saveAnimationFile(str(tmp_path / "model.m3"), "Base", 2, 1)
+    m3aFilePaths = [saveAnimationFile(str(tmp_path / ("a%d.m3a" % i)), "File%d" % i, 2 + i, 10 + i) for i in range(5)]
+    return m3FilePath, m3aFilePaths
+
+def testSplitIntoGroupsKeepsTheOrder():
+    assert transferAnimations.splitIntoGroups(list(range(5)), 2) == [[0, 1], [2, 3, 4]]
+    assert transferAnimations.splitIntoGroups(list(range(5)), 5) == [[0], [1], [2], [3], [4]]
+    assert transferAnimations.splitIntoGroups(list(range(7)), 3) == [[0, 1], [2, 3], [4, 5, 6]]
+
+def testMergedModelContainsAllSequencesAndSharesIdenticalSTS(animationFiles):
+    m3FilePath, m3aFilePaths = animationFiles
+    model = transferAnimations.mergeAnimations(m3FilePath, m3aFilePaths)
+    expectedNames = [sequence.name for filePath in [m3FilePath] + m3aFilePaths for sequence in m3.loadModel(filePath).sequences]
+    assert [sequence.name for sequence in model.sequences] == expectedNames
+    assert len(model.sequenceTransformationGroups) == len(expectedNames)
+    # All synthetic sequences animate the same bones, so the STS_ lists of the m3a files are copies of the first one of the m3 file:
+    assert len(model.sts) == 2
+    assert all(stc.stsIndex == 0 for stc in model.sequenceTransformationCollections[2:])
+
+@pytest.mark.parametrize("jobs", [2, 3, 8])
+def testParallelMergeEqualsSerialMerge(animationFiles, tmp_path, jobs):
+    m3FilePath, m3aFilePaths = animationFiles
+    serialPath = str(tmp_path / "serial.m3")
+    parallelPath = str(tmp_path / "parallel.m3")
+    m3.saveAndInvalidateModel(transferAnimations.mergeAnimations(m3FilePath, m3aFilePaths), serialPath)
+    m3.saveAndInvalidateModel(transferAnimations.mergeAnimations(m3FilePath, m3aFilePaths, jobs), parallelPath)
+    assert readBytes(parallelPath) == readBytes(serialPath)
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def testErrorsNameTheFailingFile(animationFiles, tmp_path, jobs):
+    m3FilePath, m3aFilePaths = animationFiles
+    brokenPath = str(tmp_path / "broken.m3a")
+    with open(brokenPath, "wb") as f:
+        f.write(b"broken")
+    with pytest.raises(Exception, match="broken.m3a"):
+        transferAnimations.mergeAnimations(m3FilePath, m3aFilePaths[:2] + [brokenPath], jobs)
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def testNameConflictsGetReported(animationFiles, jobs):
+    m3FilePath, m3aFilePaths = animationFiles
+    with pytest.raises(Exception, match="Animation name conflict"):
+        transferAnimations.mergeAnimations(m3FilePath, m3aFilePaths[:2] + m3aFilePaths[:1], jobs)
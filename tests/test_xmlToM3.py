@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import pytest
+import m3
+import m3ToXml
+import xmlToM3
+
+def readBytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+@pytest.mark.parametrize("xmlFileName,hexBytesPerLine", [("model.m3.xml", 0), ("model.m3.xml.gz", 0), ("model.m3.xml", 16)])
+def testRoundTripGivesIdenticalBytes(modelPath, tmp_path, xmlFileName, hexBytesPerLine):
+    xmlPath = str(tmp_path / xmlFileName)
+    m3ToXml.printModel(m3.loadModel(modelPath), xmlPath, hexBytesPerLine)
+    outputDirectory = tmp_path / "output"
+    outputDirectory.mkdir()
+    xmlToM3.convertFile(xmlPath, str(outputDirectory))
+    assert readBytes(str(outputDirectory / "model.m3")) == readBytes(modelPath)
+
+def testChildrenMustBeProcessedCompletely():
+    stream = xmlToM3.XmlElementStream(io.BytesIO(b"<a><b><c>1</c></b><d>2</d></a>"))
+    root = stream.rootElement()
+    children = stream.childElementsOf(root)
+    assert next(children).tag == "b"
+    with pytest.raises(Exception, match="The element b within a has not been processed completely"):
+        next(children)
+
+def testProcessedChildrenGetRemoved():
+    stream = xmlToM3.XmlElementStream(io.BytesIO(b"<a><b>1</b><c>2</c></a>"))
+    root = stream.rootElement()
+    texts = []
+    for child in stream.childElementsOf(root):
+        texts.append(stream.textOf(child))
+    assert texts == ["1", "2"]
+    assert len(root) == 0
+
+def testUnexpectedChildElementsGetReported(modelPath, tmp_path):
+    xmlPath = str(tmp_path / "model.m3.xml")
+    m3ToXml.printModel(m3.loadModel(modelPath), xmlPath)
+    with open(xmlPath) as f:
+        xml = f.read()
+    with open(xmlPath, "w") as f:
+        f.write(xml.replace("<modelName>Benchmark</modelName>", "<modelName>Benchmark<extra/></modelName>"))
+    with pytest.raises(Exception, match="modelName contained the child element extra"):
+        xmlToM3.convertFile(xmlPath, str(tmp_path))
+
+@pytest.fixture
+def xmlFiles(modelPath, tmp_path):
+    """ Two xml files in the directory input and the empty directory output """
+    inputDirectory = tmp_path / "input"
+    inputDirectory.mkdir()
+    (tmp_path / "output").mkdir()
+    model = m3.loadModel(modelPath)
+    xmlPaths = [str(inputDirectory / name) for name in ["a.m3.xml", "b.m3.xml"]]
+    for xmlPath in xmlPaths:
+        m3ToXml.printModel(model, xmlPath)
+    return xmlPaths
+
+def convertWithManifest(xmlPaths, tmp_path):
+    manifest = xmlToM3.ConversionManifest(str(tmp_path / "manifest.json"))
+    return xmlToM3.convertChangedFiles(xmlPaths, str(tmp_path / "output"), 1, False, manifest)
+
+def testManifestSkipsUnchangedFiles(xmlFiles, tmp_path):
+    assert convertWithManifest(xmlFiles, tmp_path) == (2, 0)
+    assert convertWithManifest(xmlFiles, tmp_path) == (0, 2)
+
+def testManifestReconvertsChangedFiles(xmlFiles, tmp_path):
+    convertWithManifest(xmlFiles, tmp_path)
+    with open(xmlFiles[1], "a") as f:
+        f.write("\n")
+    assert convertWithManifest(xmlFiles, tmp_path) == (1, 1)
+    assert convertWithManifest(xmlFiles, tmp_path) == (0, 2)
+
+def testManifestReconvertsFilesWithoutOutput(xmlFiles, tmp_path):
+    convertWithManifest(xmlFiles, tmp_path)
+    (tmp_path / "output" / "a.m3").unlink()
+    assert convertWithManifest(xmlFiles, tmp_path) == (1, 1)
+    assert (tmp_path / "output" / "a.m3").exists()
+
+def testManifestKeepsTheEntriesOfConvertedFilesAfterAFailure(xmlFiles, tmp_path):
+    brokenPath = str(tmp_path / "input" / "c.m3.xml")
+    with open(brokenPath, "w") as f:
+        f.write("<model>")
+    with pytest.raises(Exception):
+        convertWithManifest(xmlFiles + [brokenPath], tmp_path)
+    manifest = xmlToM3.ConversionManifest(str(tmp_path / "manifest.json"))
+    assert sorted(manifest.hashes) == [os.path.join("input", "a.m3.xml"), os.path.join("input", "b.m3.xml")]
+    assert convertWithManifest(xmlFiles, tmp_path) == (0, 2)
+
+def testIncrementalConversionComparesModificationTimes(xmlFiles, tmp_path):
+    outputDirectory = str(tmp_path / "output")
+    assert xmlToM3.convertChangedFiles(xmlFiles, outputDirectory, 1, True, None) == (2, 0)
+    assert xmlToM3.convertChangedFiles(xmlFiles, outputDirectory, 1, True, None) == (0, 2)
+    outputModificationTime = os.path.getmtime(os.path.join(outputDirectory, "b.m3"))
+    os.utime(xmlFiles[1], (outputModificationTime + 10, outputModificationTime + 10))
+    assert xmlToM3.convertChangedFiles(xmlFiles, outputDirectory, 1, True, None) == (1, 1)
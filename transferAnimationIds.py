@@ -26,7 +26,7 @@ import argparse
 
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Make a model use the same animation ids like another model(works only for bones with the same name yet)')
+    parser = argparse.ArgumentParser(description='Make a model use the same animation ids like another model. Animated properties get matched via the names of their bones, materials and so on, or via their indices if there are no unique names.')
     parser.add_argument('animIdFile', help="m3 with the wanted animation ids")
     parser.add_argument('modelToFix', help="m3 which has the wrong animation ids")
     parser.add_argument('outputFile', help="name of the new m3 file to create")
@@ -37,55 +37,16 @@ if __name__ == "__main__":
     modelToFix = m3.loadModel(args.modelToFix)
     outputFile = args.outputFile
 
-    boneNameToAnimIdBoneMap = {}
-    for bone in animIdModel.bones:
-        boneNameToAnimIdBoneMap[bone.name] = bone
-
-    oldAnimIdToNewAnimIdMap = {}
-    for boneToFix in modelToFix.bones:
-        boneWithAnimId = boneNameToAnimIdBoneMap[boneToFix.name]
-        oldAnimId = boneToFix.location.header.animId
-        newAnimId = boneWithAnimId.location.header.animId
-        boneToFix.location.header.animId = newAnimId
-        oldAnimIdToNewAnimIdMap[oldAnimId] = newAnimId
-        
-        oldAnimId = boneToFix.rotation.header.animId
-        newAnimId = boneWithAnimId.rotation.header.animId
-        boneToFix.rotation.header.animId = newAnimId
-        oldAnimIdToNewAnimIdMap[oldAnimId] = newAnimId
-        
-        oldAnimId = boneToFix.scale.header.animId
-        newAnimId = boneWithAnimId.scale.header.animId
-        boneToFix.scale.header.animId = newAnimId
-        oldAnimIdToNewAnimIdMap[oldAnimId] = newAnimId
-       
-    def assertModelContainsOneDivisionAndMSec(model):
-        if len(model.divisions) != 1 or len(model.divisions[0].msec) != 1:
-            raise Exception("Model contains %d divisions and the first division has %d msec" %(en(model.divisions), len(model.divisions[0].msec)))
-    
-    assertModelContainsOneDivisionAndMSec(modelToFix)
-    assertModelContainsOneDivisionAndMSec(animIdModel)
-    msecToFix = modelToFix.divisions[0].msec[0]
-    msecWithAnimId = animIdModel.divisions[0].msec[0]
-    oldAnimId = msecToFix.boundingsAnimation.header.animId
-    newAnimId = msecWithAnimId.boundingsAnimation.header.animId
-    msecToFix.boundingsAnimation.header.animId = newAnimId
-    oldAnimIdToNewAnimIdMap[oldAnimId] = newAnimId
-        
-
-    for stc in modelToFix.sequenceTransformationCollections:
-        animIds = stc.animIds
-        for i in range(len(animIds)):
-            newAnimId = oldAnimIdToNewAnimIdMap.get(animIds[i])
-            if newAnimId != None:
-                animIds[i] = newAnimId
-    
-    for sts in modelToFix.sts:
-        animIds = sts.animIds
-        for i in range(len(animIds)):
-            newAnimId = oldAnimIdToNewAnimIdMap.get(animIds[i])
-            if newAnimId != None:
-                animIds[i] = newAnimId
+    animIdIndex = m3.AnimationHeaderIndex(animIdModel)
+    indexToFix = m3.AnimationHeaderIndex(modelToFix)
+    conflicts = []
+    oldAnimIdToNewAnimIdMap = indexToFix.animIdMapTo(animIdIndex, conflicts)
+    for key, animId, newAnimId, wantedAnimId in conflicts:
+        sys.stderr.write("WARNING: The anim id %d of %s became %d instead of %d, since it is shared with a header that got mapped before\n" % (animId, key, newAnimId, wantedAnimId))
+    indexToFix.remapAnimIds(oldAnimIdToNewAnimIdMap)
+
+    numberOfMatchedHeaders = sum(1 for key in indexToFix.keyToHeaderMap if key in animIdIndex.keyToHeaderMap)
+    numberOfChangedAnimIds = sum(1 for oldAnimId, newAnimId in oldAnimIdToNewAnimIdMap.items() if oldAnimId != newAnimId)
+    print("Matched %d of %d animation headers, %d anim ids changed" % (numberOfMatchedHeaders, len(indexToFix.keyToHeaderMap), numberOfChangedAnimIds))
     
     m3.saveAndInvalidateModel(modelToFix, outputFile)
-
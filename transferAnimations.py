@@ -22,78 +22,145 @@
 
 import m3
 import sys
+import os
 import argparse
+import tempfile
+import concurrent.futures
 
+animationListNames = ["sequences", "sequenceTransformationCollections", "sequenceTransformationGroups", "sts"]
+
+class AnimationMerger:
+    """ Appends the animations of m3a models to a m3 model.
+
+    Identical STS_ anim id lists get stored only once, like the exporter does it.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.animationNames = set(sequence.name for sequence in model.sequences)
+        self.animIdListToSTSIndexMap = {}
+        for stsIndex, sts in enumerate(model.sts):
+            self.animIdListToSTSIndexMap.setdefault(tuple(sorted(sts.animIds)), stsIndex)
+
+    def getSTSIndexFor(self, sts):
+        animIdsTuple = tuple(sorted(sts.animIds))
+        stsIndex = self.animIdListToSTSIndexMap.get(animIdsTuple)
+        if stsIndex == None:
+            stsIndex = len(self.model.sts)
+            self.model.sts.append(sts)
+            self.animIdListToSTSIndexMap[animIdsTuple] = stsIndex
+        return stsIndex
+
+    def checkCompatibility(self, m3aModel):
+        for listName in animationListNames:
+            modelList = getattr(self.model, listName)
+            m3aList = getattr(m3aModel, listName)
+            if len(modelList) > 0 and len(m3aList) > 0 and modelList[0].structureDescription != m3aList[0].structureDescription:
+                raise Exception("The animation data has been stored in differnt formats")
+        if self.model.uniqueUnknownNumber != m3aModel.uniqueUnknownNumber:
+            raise Exception("The animations / the m3a file has not been made for the m3 file")
+        animationNameConflicts = self.animationNames.intersection(sequence.name for sequence in m3aModel.sequences)
+        if len(animationNameConflicts) > 0:
+            raise Exception("Animation name conflict detected: %s" % animationNameConflicts)
+        if len(m3aModel.sequenceTransformationGroups) != len(m3aModel.sequences):
+            raise Exception("Script or model incorrect: The model has not the same amounth of stg elements as it has sequences.")
+
+    def merge(self, m3aModel):
+        self.checkCompatibility(m3aModel)
+        model = self.model
+        for sequence, stg in zip(m3aModel.sequences, m3aModel.sequenceTransformationGroups):
+            newSTCIndices = []
+            for oldSTCIndex in stg.stcIndices:
+                stc = m3aModel.sequenceTransformationCollections[oldSTCIndex]
+                if stc.stsIndex != stc.stsIndexCopy:
+                    raise Exception("Script or model incorrect: stsIndex != stsIndexCopy.")
+                stc.stsIndex = self.getSTSIndexFor(m3aModel.sts[stc.stsIndex])
+                stc.stsIndexCopy = stc.stsIndex
+                newSTCIndices.append(len(model.sequenceTransformationCollections))
+                model.sequenceTransformationCollections.append(stc)
+            stg.stcIndices = newSTCIndices
+            model.sequences.append(sequence)
+            model.sequenceTransformationGroups.append(stg)
+            self.animationNames.add(sequence.name)
+
+def loadModel(filePath, validate=True):
+    try:
+        return m3.loadModel(filePath, checkExpectedValue=validate, validate=validate)
+    except Exception as e:
+        raise Exception("%s: %s" % (filePath, e))
+
+def mergeInto(merger, m3aModel, description):
+    try:
+        merger.merge(m3aModel)
+    except Exception as e:
+        raise Exception("%s: %s" % (description, e))
+
+def mergeGroup(m3aFilePaths, outputFilePath):
+    """ Merges the animations of the m3a files into a single m3a file; gets executed in worker processes
+
+    The files get validated when they get loaded, so the merged file gets saved without a further validation.
+    """
+    merger = AnimationMerger(loadModel(m3aFilePaths[0]))
+    for m3aFilePath in m3aFilePaths[1:]:
+        mergeInto(merger, loadModel(m3aFilePath), m3aFilePath)
+    m3.saveAndInvalidateModel(merger.model, outputFilePath, validate="none")
+
+def splitIntoGroups(items, numberOfGroups):
+    """ Splits the items into that many groups of consecutive items, whose sizes differ at most by one """
+    groups = []
+    start = 0
+    for groupIndex in range(numberOfGroups):
+        end = start + (len(items) - start) // (numberOfGroups - groupIndex)
+        groups.append(items[start:end])
+        start = end
+    return groups
+
+def mergeAnimations(m3FilePath, m3aFilePaths, jobs=1):
+    """ Returns the model of the m3 file with the animations of the m3a files appended in the given order.
+
+    With jobs > 1 the m3a files get split into that many groups of consecutive files. Worker
+    processes load and validate the files of a group and merge them into a temporary m3a file,
+    while this process loads the m3 file. The generated structure classes can't be pickled, so the
+    m3 format is used to pass the merged animations back. This process loads them without
+    validating them again and merges them in the order of the groups, which results in the same
+    model as merging the files one by one.
+    """
+    numberOfGroups = min(jobs, len(m3aFilePaths))
+    if numberOfGroups <= 1:
+        merger = AnimationMerger(loadModel(m3FilePath))
+        for m3aFilePath in m3aFilePaths:
+            mergeInto(merger, loadModel(m3aFilePath), m3aFilePath)
+        return merger.model
+    groups = splitIntoGroups(m3aFilePaths, numberOfGroups)
+    with tempfile.TemporaryDirectory() as temporaryDirectory, concurrent.futures.ProcessPoolExecutor(max_workers=numberOfGroups) as executor:
+        groupFilePaths = [os.path.join(temporaryDirectory, "group%d.m3a" % groupIndex) for groupIndex in range(numberOfGroups)]
+        futures = [executor.submit(mergeGroup, group, groupFilePath) for group, groupFilePath in zip(groups, groupFilePaths)]
+        try:
+            merger = AnimationMerger(loadModel(m3FilePath))
+            for group, groupFilePath, future in zip(groups, groupFilePaths, futures):
+                future.result()
+                mergeInto(merger, loadModel(groupFilePath, validate=False), ", ".join(group))
+        finally:
+            for future in futures:
+                future.cancel()
+    return merger.model
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Combines an m3 and m3a file')
+    parser = argparse.ArgumentParser(description='Combines an m3 file with the animations of m3a files')
     parser.add_argument('m3File', help="m3 file")
-    parser.add_argument('m3aFile', help="m3a files with extra animations for the m3 file")
+    parser.add_argument('m3aFile', nargs='+', help="m3a files with extra animations for the m3 file")
     parser.add_argument('outputFile', help="name of the new m3 file to create")
+    parser.add_argument('-j', '--jobs',
+        type=int, default=1,
+        help='Number of processes which load and merge the m3a files (0 = one per CPU core)')
     args = parser.parse_args()
 
-
-    m3Model = m3.loadModel(args.m3File) 
-    m3aModel = m3.loadModel(args.m3aFile)
-    outputFile = args.outputFile
-    sameFormat = True
-
-    if (len(m3Model.sequences) > 0 and len(m3aModel.sequences) > 0 ):
-        if m3Model.sequences[0].structureDescription != m3aModel.sequences[0].structureDescription:
-            sameFormat = False
-    if (len(m3Model.sequenceTransformationCollections) > 0 and len(m3aModel.sequenceTransformationCollections) > 0 ):
-        if m3Model.sequenceTransformationCollections[0].structureDescription != m3aModel.sequenceTransformationCollections[0].structureDescription:
-            sameFormat = False
-    if (len(m3Model.sequenceTransformationGroups) > 0 and len(m3aModel.sequenceTransformationGroups) > 0 ):
-        if m3Model.sequenceTransformationGroups[0].structureDescription != m3aModel.sequenceTransformationGroups[0].structureDescription:
-            sameFormat = False
-    if (len(m3Model.sts) > 0 and len(m3aModel.sts) > 0 ):
-        if m3Model.sts[0].structureDescription != m3aModel.sts[0].structureDescription:
-            sameFormat = False
-
-    if not sameFormat:
-        sys.stderr.write("The animation data has been stored in differnt formats\n")
-        sys.exit(1)
-            
-    if m3Model.uniqueUnknownNumber != m3aModel.uniqueUnknownNumber:
-        sys.stderr.write("The animations / the m3a file has not been made for the m3 file\n")
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+    try:
+        model = mergeAnimations(args.m3File, args.m3aFile, jobs)
+    except Exception as e:
+        sys.stderr.write("%s\n" % e)
         sys.exit(1)
-    
-    m3aAnimationNames = set()
-    for seq in m3aModel.sequences:
-        m3aAnimationNames.add(seq.name)
-        
-    m3AnimationNames = set()
-    for seq in m3Model.sequences:
-        m3AnimationNames.add(seq.name)
-
-    animationNameConflicts = m3AnimationNames.intersection(m3aAnimationNames)
-    if len(animationNameConflicts) > 0:
-        sys.stderr.write("Animation name conflict detected: %s\n" % animationNameConflicts)
-        sys.exit(1)
-
-    numberOfSequences = len(m3aModel.sequences)
-    if len(m3aModel.sequenceTransformationGroups) != numberOfSequences:
-        raise Exception("Script or model incorrect: The model has not the same amounth of stg elements as it has sequences.")
-    for sequenceIndex in range(numberOfSequences):
-        sequence = m3aModel.sequences[sequenceIndex]
-        stg = m3aModel.sequenceTransformationGroups[sequenceIndex]
-        newSTCIndices = []
-        for oldSTCIndex in stg.stcIndices:
-            stc = m3aModel.sequenceTransformationCollections[oldSTCIndex]
-            if stc.stsIndex != stc.stsIndexCopy:
-                raise Exception("Script or model incorrect: stsIndex != stsIndexCopy.")
-            sts = m3aModel.sts[stc.stsIndex]
-            stc.stsIndex = len(m3Model.sts)
-            stc.stsIndexCopy = stc.stsIndex
-            m3Model.sts.append(sts)
-            newSTCIndex = len(m3Model.sequenceTransformationCollections)
-            m3Model.sequenceTransformationCollections.append(stc)
-            newSTCIndices.append(newSTCIndex)
-        stg.stcIndices = newSTCIndices
-        m3Model.sequences.append(sequence)
-        m3Model.sequenceTransformationGroups.append(stg)
-    
-    
-    m3.saveAndInvalidateModel(m3Model, outputFile)
 
+    # All files got validated when they got loaded and the merge only appends structures and sets indices:
+    m3.saveAndInvalidateModel(model, args.outputFile, validate="serialize")
@@ -22,32 +22,76 @@
 import struct
 import sys
 import m3
-import xml.dom.minidom
-from xml.dom.minidom import Node
+import xml.etree.ElementTree as ElementTree
+import gzip
 import argparse
 import os
 import time
+import hashlib
+import json
+import concurrent.futures
+import fileWatcher
 
-def forElementsIn(xmlNode):
-    for child in xmlNode.childNodes:
-        if type(child) == xml.dom.minidom.Text:
-            if not child.wholeText.isspace():
-                raise Exception("Unexpected content \"%s\" within element %s" % (child.wholeText, xmlNode.nodeName))
-        else:
-            yield child
+class XmlElementStream:
+    """ Provides the elements of a XML file while it gets parsed.
+
+    The children of an element get requested via childElementsOf and each child
+    must be processed completely before the next one gets requested, otherwise
+    an exception gets raised. Processed children get removed from their parent,
+    so only the path from the root to the current element stays in memory.
+    """
+    def __init__(self, source):
+        self.events = ElementTree.iterparse(source, events=("start", "end"))
+
+    def rootElement(self):
+        event, element = next(self.events)
+        return element
+
+    def childElementsOf(self, xmlElement):
+        previousChild = None
+        for event, element in self.events:
+            if previousChild == None:
+                checkForUnexpectedText(xmlElement.text, xmlElement)
+            else:
+                checkForUnexpectedText(previousChild.tail, xmlElement)
+                xmlElement.remove(previousChild)
+                # The previous children got removed, so the next child is the first one:
+                if element is not xmlElement and (event == "end" or len(xmlElement) == 0 or xmlElement[0] is not element):
+                    raise Exception("The element %s within %s has not been processed completely" % (previousChild.tag, xmlElement.tag))
+            if event == "end":
+                return
+            yield element
+            previousChild = element
+
+    def textOf(self, xmlElement):
+        """ Returns the text of the element or None if it has none """
+        event, element = next(self.events)
+        if event != "end":
+            raise Exception("Element %s contained the child element %s." % (xmlElement.tag, element.tag))
+        return xmlElement.text
 
-def createSingleStructureElement(xmlNode, structureDescription):
+    def skipContentOf(self, xmlElement):
+        for event, element in self.events:
+            if event == "end" and element is xmlElement:
+                break
+        xmlElement.clear()
+
+def checkForUnexpectedText(text, xmlElement):
+    if text != None and not text.isspace():
+        raise Exception("Unexpected content \"%s\" within element %s" % (text, xmlElement.tag))
+
+def createSingleStructureElement(stream, xmlElement, structureDescription):
     createdObject = structureDescription.createInstance()
     fieldIndex = 0
-    for child in forElementsIn(xmlNode):
-        fieldName = child.nodeName
+    for child in stream.childElementsOf(xmlElement):
+        fieldName = child.tag
         if fieldIndex >= len(structureDescription.fields):
             raise Exception("XML file is incompatible: too many fields")
         field = structureDescription.fields[fieldIndex]
         if field.name != fieldName:
             raise Exception("XML file is incompatible: Expected field %s but found field %s" % (field.name, fieldName) )
         
-        fieldContent = createFieldContent(child,field)
+        fieldContent = createFieldContent(stream, child, field)
         setattr(createdObject, field.name, fieldContent)
         fieldIndex += 1
     
@@ -58,166 +102,251 @@ def createSingleStructureElement(xmlNode, structureDescription):
     return createdObject
                 
 intTypeStrings = set(["int32","int16","int8","uint32", "uint16", "uint8"])     
-def createFieldContent(xmlNode, field):
+def createFieldContent(stream, xmlElement, field):
     if isinstance(field, m3.ReferenceField):
         if field.historyOfReferencedStructures == None:
+            stream.skipContentOf(xmlElement)
             return [] # TODO check if that's correct
         else:
             referencedStructureName = field.historyOfReferencedStructures.name
             if referencedStructureName == "CHAR":
-                if len(xmlNode.childNodes) == 0:
-                    return None
-                return stringContentOf(xmlNode)
+                return stream.textOf(xmlElement)
             elif referencedStructureName == "U8__":
-                return bytearray(hexToBytes(stringContentOf(xmlNode), xmlNode))
+                return bytearray(hexToBytes(stringContentOf(stream, xmlElement), xmlElement))
             else:
-                if field.historyOfReferencedStructures != None:
-                    return createElementList(xmlNode, field.name, field.historyOfReferencedStructures)
-                else:
-                    return createElementList(xmlNode, field.name, None)
+                return createElementList(stream, xmlElement, field.name, field.historyOfReferencedStructures)
 
     elif isinstance(field, m3.UnknownBytesField):
-        return hexToBytes(stringContentOf(xmlNode),xmlNode)
+        return hexToBytes(stringContentOf(stream, xmlElement), xmlElement)
     elif isinstance(field, m3.PrimitiveField):
         if field.typeString == "float":
-            return float(stringContentOf(xmlNode))
+            return float(stringContentOf(stream, xmlElement))
         elif field.typeString in intTypeStrings:
-            return int(stringContentOf(xmlNode), 0)
+            return int(stringContentOf(stream, xmlElement), 0)
         else:
             raise Exception("Unsupported primtive: %s" % field.typeString)
     elif isinstance(field, m3.EmbeddedStructureField):
-        return createSingleStructureElement(xmlNode, field.structureDescription)
+        return createSingleStructureElement(stream, xmlElement, field.structureDescription)
     else: # TagField
         raise Exception("Unsupported field type %s" % type(field))
 
-def removeWhitespace(s):
-    return s.translate({ord(" "):None,ord("\t"):None,ord("\r"):None,ord("\n"):None})
-
-def hexToBytes(hexString, xmlNode):
-    hexString = removeWhitespace(hexString)
+def hexToBytes(hexString, xmlElement):
+    hexString = hexString.strip()
     if hexString == "":
         return bytearray(0)
     if not hexString.startswith("0x"):
-        raise Exception('hex string "%s" of node %s does not start with 0x' % (hexString,xmlNode.nodeName) )
-    hexString = hexString[2:]
-    return bytes([int(hexString[x:x+2], 16) for x in range(0, len(hexString),2)])
-
-def stringContentOf(xmlNode):
-    content = ""
-    for child in xmlNode.childNodes:
-        if child.nodeType == Node.TEXT_NODE:
-            content += child.data
-        else:
-            raise Exception("Element %s contained childs of xml node type %s." % (xmlNode.nodeName,type(xmlNode)))
+        raise Exception('hex string "%s" of node %s does not start with 0x' % (hexString,xmlElement.tag) )
+    # fromhex skips the whitespace of line wrapped hex strings
+    return bytes.fromhex(hexString[2:])
+
+def stringContentOf(stream, xmlElement):
+    content = stream.textOf(xmlElement)
+    if content == None:
+        return ""
     return content
 
-def createListElement(xmlNode, structureDescription):
+def createListElement(stream, xmlElement, structureDescription):
     if structureDescription.structureName in ["I32_","I16_", "I8__", "U32_", "U16_", "U8__", "FLAG"]:
-        return int(stringContentOf(xmlNode), 0)
+        return int(stringContentOf(stream, xmlElement), 0)
     elif structureDescription.structureName in ["REAL"]:
-        return float(stringContentOf(xmlNode))
+        return float(stringContentOf(stream, xmlElement))
     else:
-        return createSingleStructureElement(xmlNode, structureDescription)
+        return createSingleStructureElement(stream, xmlElement, structureDescription)
       
       
-def childElementsOf(parentName, xmlNode):
+def childElementsOf(stream, parentName, xmlElement):
     expectedChildNames = parentName + "-element"
-    for child in xmlNode.childNodes:
-        if type(child) == xml.dom.minidom.Text:
-            if not child.data.isspace():
-                raise Exception("Unexpected content \"%s\" within element %s" % (child.wholeText, xmlNode.nodeName))
-        else:
-            if (child.nodeName != expectedChildNames):
-                raise Exception("Unexpected child \"%s\" within element %s", (child.nodeName, xmlNode.nodeName))
-            yield child
+    for child in stream.childElementsOf(xmlElement):
+        if (child.tag != expectedChildNames):
+            raise Exception("Unexpected child \"%s\" within element %s" % (child.tag, xmlElement.tag))
+        yield child
 
-def createElementList(xmlNode, parentName, historyOfReferencedStructure):
-    xmlElements = list(childElementsOf(parentName, xmlNode))
+def listStructureDescriptionOf(xmlElement, parentName, historyOfReferencedStructure):
     if historyOfReferencedStructure.name in ["CHAR", "I32_","I16_", "I8__", "U32_", "U16_", "U8__", "REAL", "FLAG"]:
-        structVersion = 0
-    else:
-        if len(xmlElements) == 0:
-            return []
-        
-        child = xmlNode.firstChild
-        structVersion = int(xmlNode.getAttribute("structureVersion"))
-        structName = xmlNode.getAttribute("structureName")
-        if structName == "" or structVersion == "":
-            raise Exception("Incompatible format: Require now a strutureName and structureVerson attribute for the list %s" % parentName)
-        if structName != historyOfReferencedStructure.name:
-            raise Exception("Expected a %s to have the structure name %s instead of %s" % (parentName,  historyOfReferencedStructure.name, structName))
-    structureDescription = historyOfReferencedStructure.getVersion(structVersion)
+        return historyOfReferencedStructure.getVersion(0)
+    structVersion = xmlElement.get("structureVersion", "")
+    structName = xmlElement.get("structureName", "")
+    if structName == "" or structVersion == "":
+        raise Exception("Incompatible format: Require now a strutureName and structureVerson attribute for the list %s" % parentName)
+    if structName != historyOfReferencedStructure.name:
+        raise Exception("Expected a %s to have the structure name %s instead of %s" % (parentName,  historyOfReferencedStructure.name, structName))
+    return historyOfReferencedStructure.getVersion(int(structVersion))
+
+def createElementList(stream, xmlElement, parentName, historyOfReferencedStructure):
+    structureDescription = None
     createdList = []
-    for child in xmlElements:
-        o = createListElement(child, structureDescription)
+    for child in childElementsOf(stream, parentName, xmlElement):
+        if structureDescription == None:
+            structureDescription = listStructureDescriptionOf(xmlElement, parentName, historyOfReferencedStructure)
+        o = createListElement(stream, child, structureDescription)
         createdList.append(o)
         
     return createdList
         
+def isM3XmlFile(fileName):
+    return fileName.endswith(".m3.xml") or fileName.endswith(".m3.xml.gz")
 
+def openInputFile(inputFilePath):
+    if inputFilePath.endswith(".gz"):
+        return gzip.open(inputFilePath, "rb")
+    return open(inputFilePath, "rb")
 
-def convertFile(inputFilePath, outputDirectory):
+def outputFilePathFor(inputFilePath, outputDirectory):
+    outputFilePath = inputFilePath[:inputFilePath.rindex(".xml")]
     if outputDirectory != None:
-        fileName = os.path.basename(inputFilePath)
-        outputFilePath = os.path.join(outputDirectory, fileName[:-4])
-    else:
-        outputFilePath = inputFilePath[:-4]
+        outputFilePath = os.path.join(outputDirectory, os.path.basename(outputFilePath))
+    return outputFilePath
+
+def convertFile(inputFilePath, outputDirectory):
+    outputFilePath = outputFilePathFor(inputFilePath, outputDirectory)
     print("Converting %s -> %s" % (inputFilePath, outputFilePath))
-    doc = xml.dom.minidom.parse(inputFilePath)
-    modelElement = doc.firstChild
-    structVersion = int(modelElement.getAttribute("structureVersion"))
-    structName = modelElement.getAttribute("structureName")
-    modelDescription = m3.structures[structName].getVersion(structVersion)
-    model = createSingleStructureElement(modelElement, modelDescription)
+    with openInputFile(inputFilePath) as inputFile:
+        stream = XmlElementStream(inputFile)
+        modelElement = stream.rootElement()
+        structVersion = int(modelElement.get("structureVersion"))
+        structName = modelElement.get("structureName")
+        modelDescription = m3.structures[structName].getVersion(structVersion)
+        model = createSingleStructureElement(stream, modelElement, modelDescription)
     m3.saveAndInvalidateModel(model, outputFilePath)
 
- 
+def findXmlFiles(paths):
+    for filePath in paths:
+        if os.path.isdir(filePath):
+            for fileName in os.listdir(filePath):
+                if isM3XmlFile(fileName):
+                    yield os.path.join(filePath, fileName)
+        else:
+            yield filePath
+
+def isOutputNewer(inputFilePath, outputDirectory):
+    outputFilePath = outputFilePathFor(inputFilePath, outputDirectory)
+    return os.path.exists(outputFilePath) and os.path.getmtime(outputFilePath) >= os.path.getmtime(inputFilePath)
+
+def contentHashOf(filePath):
+    contentHash = hashlib.sha1()
+    with open(filePath, "rb") as f:
+        for block in iter(lambda: f.read(1024*1024), b""):
+            contentHash.update(block)
+    return contentHash.hexdigest()
+
+class ConversionManifest:
+    """ Remembers the content hashes of the converted files in a JSON file """
+    
+    def __init__(self, manifestPath):
+        self.manifestPath = manifestPath
+        self.manifestDirectory = os.path.dirname(os.path.abspath(manifestPath))
+        self.hashes = {}
+        if os.path.exists(manifestPath):
+            with open(manifestPath) as f:
+                self.hashes = json.load(f)
+    
+    def keyOf(self, filePath):
+        return os.path.relpath(os.path.abspath(filePath), self.manifestDirectory)
+    
+    def isUnchanged(self, filePath, contentHash):
+        return self.hashes.get(self.keyOf(filePath)) == contentHash
+    
+    def update(self, filePath, contentHash):
+        self.hashes[self.keyOf(filePath)] = contentHash
+    
+    def save(self):
+        temporaryPath = self.manifestPath + ".tmp"
+        with open(temporaryPath, "w") as f:
+            json.dump(self.hashes, f, indent=1, sort_keys=True)
+        os.replace(temporaryPath, self.manifestPath)
+
+def convertFiles(inputFilePaths, outputDirectory, jobs=1):
+    """ Converts the files, with jobs > 1 in that many parallel processes; yields each converted file """
+    if jobs > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(convertFile, inputFilePath, outputDirectory): inputFilePath for inputFilePath in inputFilePaths}
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+                    yield futures[future]
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+    else:
+        for inputFilePath in inputFilePaths:
+            convertFile(inputFilePath, outputDirectory)
+            yield inputFilePath
+
+def convertChangedFiles(inputFilePaths, outputDirectory, jobs, incremental, manifest):
+    """ Converts the files which are not unchanged according to the incremental option or the manifest.
+
+    Returns the number of converted and skipped files.
+    """
+    if manifest != None:
+        contentHashes = {}
+        for inputFilePath in inputFilePaths:
+            contentHashes[inputFilePath] = contentHashOf(inputFilePath)
+        filesToConvert = [f for f in inputFilePaths if not (manifest.isUnchanged(f, contentHashes[f]) and os.path.exists(outputFilePathFor(f, outputDirectory)))]
+    elif incremental:
+        filesToConvert = [f for f in inputFilePaths if not isOutputNewer(f, outputDirectory)]
+    else:
+        filesToConvert = inputFilePaths
+    
+    counter = 0
+    try:
+        for inputFilePath in convertFiles(filesToConvert, outputDirectory, jobs):
+            if manifest != None:
+                manifest.update(inputFilePath, contentHashes[inputFilePath])
+            counter += 1
+    finally:
+        if manifest != None:
+            manifest.save()
+    return counter, len(inputFilePaths) - len(filesToConvert)
+
+def printSummary(counter, skipped):
+    if counter == 1:
+        print("Converted %d file from .m3.xml to .m3" % counter)
+    else:
+        print("Converted %d files from .m3.xml to .m3" % counter)
+    if skipped > 0:
+        print("Skipped %d unchanged files" % skipped)
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument('path', nargs='+', help="Either a *.m3.xml file or a directory with *.m3.xml files generated with m3ToXml.py")
+    parser.add_argument('path', nargs='+', help="Either a *.m3.xml(.gz) file or a directory with *.m3.xml(.gz) files generated with m3ToXml.py")
     parser.add_argument('--output-directory', '-o', help='Directory in which m3 files will be placed')
-    parser.add_argument('--watch', action='store_const', const=True, default=False)
+    parser.add_argument('--watch', action='store_const', const=True, default=False, help='Keep running and convert the given files or the files in the given directories again when they change')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of files to convert in parallel (0 = one per CPU core)')
+    parser.add_argument('-i', '--incremental', action='store_true', default=False, help='Skip files whose m3 file is newer than the xml file')
+    parser.add_argument('--manifest', help='JSON file with the content hashes of converted files; files with an unchanged hash and an existing m3 file get skipped')
     args = parser.parse_args()
     outputDirectory = args.output_directory
     if outputDirectory != None and not os.path.isdir(outputDirectory):
         sys.stderr.write("%s is not a directory" % outputDirectory)
         sys.exit(2)
     for filePath in args.path:
-        if not (filePath.endswith(".m3.xml") or os.path.isdir(filePath)):
-            sys.stderr.write("%s neither a directory nor does it end with '.m3.xml'\n" % filePath)
+        if not (isM3XmlFile(filePath) or os.path.isdir(filePath)):
+            sys.stderr.write("%s neither a directory nor does it end with '.m3.xml' or '.m3.xml.gz'\n" % filePath)
             sys.exit(2)
-            
-            
+
+    
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+    manifest = None
+    if args.manifest != None:
+        manifest = ConversionManifest(args.manifest)
+    watcher = None
     if args.watch:
-        if ((len(args.path) == 0) or os.path.isdir(filePath)):
-            sys.stderr.write("Watch option is only supported for a single file")
-            sys.exit(2)
-        
-        previousModelModiticationTime = os.path.getmtime(filePath)
-        convertFile(filePath, outputDirectory)
-        print("Converted %s to an m3 file. Will convert it again if it changes" % filePath)
+        # created before the first conversion, so that no change gets missed
+        watcher = fileWatcher.FileWatcher(args.path, isM3XmlFile)
+    
+    counter, skipped = convertChangedFiles(list(findXmlFiles(args.path)), outputDirectory, jobs, args.incremental, manifest)
+    printSummary(counter, skipped)
+    
+    if watcher != None:
+        print("Watching %s for changes" % ", ".join(args.path))
         while True:
-            currentModelModificationTime = os.path.getmtime(filePath)
-            if currentModelModificationTime > previousModelModiticationTime:
-                print("File modified at %s, converting again" % time.ctime(currentModelModificationTime))
-                convertFile(filePath, outputDirectory)
-                print("converted file")
-                previousModelModiticationTime = currentModelModificationTime
-            time.sleep(0.1)
-    else:
-        counter = 0
-        for filePath in args.path:
-            if os.path.isdir(filePath):
-                for fileName in os.listdir(filePath):
-                    inputFilePath = os.path.join(filePath, fileName)
-                    if fileName.endswith(".m3.xml"):
-                        convertFile(inputFilePath, outputDirectory)
-                        counter += 1
+            changedFiles = sorted(watcher.waitForChanges())
+            print("%d files modified at %s, converting again" % (len(changedFiles), time.ctime()))
+            try:
+                counter, skipped = convertChangedFiles(changedFiles, outputDirectory, jobs, args.incremental, manifest)
+            except Exception as e:
+                sys.stderr.write("Conversion failed: %s\n" % e)
             else:
-                convertFile(filePath, outputDirectory)
-                counter += 1
-        if counter == 1:
-            print("Converted %d file from .m3.xml to .m3" % counter)
-        else:
-            print("Converted %d files from .m3.xml to .m3" % counter)
+                printSummary(counter, skipped)